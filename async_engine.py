@@ -0,0 +1,145 @@
+# 异步数据收集引擎 - 单个事件循环上扇出所有上游请求，按主机限流，阻塞库通过有界线程池桥接
+import asyncio
+import os
+import time
+
+import deadline
+import http_client
+import metrics
+import source_health
+
+EXECUTOR_WORKERS = int(os.environ.get("ASYNC_EXECUTOR_WORKERS", "16"))
+
+
+class AsyncEngine:
+    """所有阻塞调用都经过 run_blocking：先占用主机信号量，再占用线程池名额
+
+    线程池基于守护线程（deadline.spawn），被取消的调用不会阻止进程退出。
+    """
+
+    def __init__(self, max_workers=EXECUTOR_WORKERS, host_concurrency=http_client.HOST_CONCURRENCY):
+        self._workers = asyncio.Semaphore(max_workers)
+        self._host_concurrency = host_concurrency
+        self._host_semaphores = {}
+
+    def _host_semaphore(self, host):
+        if host not in self._host_semaphores:
+            self._host_semaphores[host] = asyncio.Semaphore(self._host_concurrency)
+        return self._host_semaphores[host]
+
+    async def run_blocking(self, host, func, *args, **kwargs):
+        """在线程池中执行阻塞函数，调用方被取消时同时取消该任务的截止时间"""
+        async with self._host_semaphore(host), self._workers:
+            task_deadline = deadline.Deadline(parent=deadline.current(), name=getattr(func, "__name__", ""))
+            future = deadline.spawn(func, *args, deadline=task_deadline, **kwargs)
+            try:
+                return await asyncio.wrap_future(future)
+            except asyncio.CancelledError:
+                task_deadline.cancel()
+                raise
+
+    async def race(self, data_sources, is_valid=bool, mode="hedge", hedge_delay=1.5, chain=""):
+        """按优先级从多个数据源获取数据（同步代码通过 comprehensive_report.fetch_from_sources 调用）
+
+        data_sources 为 (source_name, host, get_func) 列表。sequential模式逐个尝试；race模式同时
+        发起所有数据源；hedge模式每隔hedge_delay秒发起下一个数据源（前一个失败时立即发起）。
+        一旦优先级最高的有效结果确定即返回 (source_name, value)，其余任务被取消且不再等待。
+        全部失败或超过当前截止时间返回 (None, None)。每次尝试以chain为标签记录指标，
+        chain不为空时按数据源健康记录调整顺序并跳过熔断中的数据源。
+        """
+        data_sources = source_health.order(chain, data_sources)
+        stage = deadline.current()
+
+        async def attempt(source_name, host, get_func):
+            value = None
+            try:
+                with metrics.span("source", source_name, chain=chain) as attempt_span:
+                    try:
+                        deadline.check()
+                        value = await self.run_blocking(host, get_func)
+                        if value is None or not is_valid(value):
+                            value = None
+                            attempt_span.set(status="empty")
+                    except asyncio.CancelledError:
+                        attempt_span.set(status="cancelled")
+                        raise
+                    except deadline.DeadlineExceeded:
+                        attempt_span.set(status="cancelled")
+                    except Exception as e:
+                        print(f"❌ {source_name}获取失败: {e}")
+                        attempt_span.set(status="error", error=str(e)[:200])
+            finally:
+                source_health.record(chain, source_name, attempt_span.status, attempt_span.duration)
+            return value
+
+        if mode == "sequential":
+            for source_name, host, get_func in data_sources:
+                value = await attempt(source_name, host, get_func)
+                if value is not None:
+                    return source_name, value
+            return None, None
+
+        delay = 0 if mode == "race" else hedge_delay
+        tasks = {}
+        results = {}
+        next_index = 0
+        next_launch = time.monotonic()
+        try:
+            while True:
+                now = time.monotonic()
+                while next_index < len(data_sources) and now >= next_launch:
+                    tasks[next_index] = asyncio.ensure_future(attempt(*data_sources[next_index]))
+                    next_index += 1
+                    next_launch = now + delay
+
+                for i in range(len(data_sources)):
+                    if i not in results:
+                        break
+                    if results[i] is not None:
+                        return data_sources[i][0], results[i]
+                else:
+                    return None, None
+
+                if stage is not None and stage.expired():
+                    print("⌛ 截止时间已到，放弃尚未返回的数据源")
+                    return None, None
+
+                pending = [t for i, t in tasks.items() if i not in results]
+                timeout = deadline.remaining()
+                if next_index < len(data_sources):
+                    until_next = max(0.0, next_launch - time.monotonic())
+                    timeout = until_next if timeout is None else min(timeout, until_next)
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                for i, task in tasks.items():
+                    if task in done:
+                        results[i] = task.result()
+                        if results[i] is None:
+                            next_launch = time.monotonic()
+        finally:
+            for task in tasks.values():
+                task.cancel()
+
+
+async def gather_partial(coroutines, timeout):
+    """并发执行命名协程，timeout秒后取消未完成的任务
+
+    coroutines 为 {name: 协程或任务}，返回 {name: 结果}；超时或异常的任务不出现在结果中。
+    """
+    tasks = {name: asyncio.ensure_future(coro) for name, coro in coroutines.items()}
+    if not tasks:
+        return {}
+    done, pending = await asyncio.wait(list(tasks.values()), timeout=timeout)
+    for task in pending:
+        task.cancel()
+    if pending:
+        await asyncio.gather(*pending, return_exceptions=True)
+
+    results = {}
+    for name, task in tasks.items():
+        if task in pending:
+            print(f"⌛ {name}数据未在截止时间内返回，已丢弃")
+        elif task.exception() is not None:
+            print(f"❌ {name}数据获取失败: {task.exception()}")
+        else:
+            results[name] = task.result()
+    return results
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+基准测试 - 基于录制的fixture（见replay.py）在不同延迟/失败场景下测量报告流程的性能
+使用方法：
+1. 先录制一次真实运行: REPLAY_MODE=record python comprehensive_report.py
+2. 保存基准: python benchmark.py --save-baseline
+3. 之后对比: python benchmark.py （超出基准阈值时退出码为1）
+
+每个 场景 x 目标 在独立子进程中运行（回放配置在导入时读取，且各次运行互不共享进程内缓存），
+记录墙钟时间、请求数（HTTP + 库调用）、传输字节数和Python内存峰值（tracemalloc）。
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+BENCHMARK_BASELINE = os.environ.get(
+    "BENCHMARK_BASELINE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "benchmark_baseline.json"))
+# 相对基准的允许增幅（0.2 = 20%）
+BENCHMARK_THRESHOLD = float(os.environ.get("BENCHMARK_THRESHOLD", "0.2"))
+# 墙钟时间的绝对容差（秒），避免很短的测量因调度抖动误报
+TIME_TOLERANCE = float(os.environ.get("BENCHMARK_TIME_TOLERANCE", "0.05"))
+
+RESULT_PREFIX = "BENCHMARK_RESULT "
+
+# 场景 -> 回放环境变量
+SCENARIOS = {
+    "recorded": {},
+    "slow": {"REPLAY_LATENCY_SCALE": "2", "REPLAY_EXTRA_LATENCY": "0.2"},
+    "flaky": {"REPLAY_FAILURE_RATE": "0.3"},
+    "outage": {"REPLAY_FAIL": "akshare,stock.xueqiu.com"},
+}
+
+TARGETS = ["main", "get_china_stock_data", "get_bond_data", "get_us_stock_data", "get_crypto_data", "get_weather"]
+
+METRICS = ["wall_time", "requests", "bytes", "peak_memory"]
+
+
+def run_target(target):
+    """在当前进程中执行一个目标并返回测量结果（由子进程调用）"""
+    import comprehensive_report
+    import metrics
+
+    if target == "get_weather":
+        func = lambda: comprehensive_report.get_weather(comprehensive_report.WEATHER_CITIES[0])
+    else:
+        func = getattr(comprehensive_report, target)
+
+    metrics.reset()
+    tracemalloc.start()
+    start_time = time.perf_counter()
+    func()
+    wall_time = time.perf_counter() - start_time
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    calls = metrics.spans("http") + metrics.spans("library")
+    return {
+        "wall_time": wall_time,
+        "requests": len(calls),
+        "bytes": sum(s.get("bytes", 0) for s in calls),
+        "peak_memory": peak_memory,
+    }
+
+
+def run_once(scenario, target):
+    """在子进程中运行一次，返回测量结果；子进程失败时返回None"""
+    env = dict(os.environ, REPLAY_MODE="replay", METRICS_TRACE_FILE="", METRICS_PROM_FILE="",
+               PYTHONUNBUFFERED="1", **SCENARIOS[scenario])
+    # 回放不校验凭证，未配置时补上占位值以便走完发送流程
+    for var in ("APP_ID", "APP_SECRET", "OPEN_ID", "TEMPLATE_ID", "HEFENG_KEY"):
+        env.setdefault(var, f"replay_{var.lower()}")
+    process = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--worker", target],
+        env=env, capture_output=True, text=True, encoding="utf-8")
+    for line in reversed(process.stdout.splitlines()):
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    print(f"❌ {scenario}/{target} 子进程失败 (退出码{process.returncode}):\n{process.stderr[-2000:]}")
+    return None
+
+
+def run_suite(scenarios, targets, repeat):
+    """每个 场景 x 目标 运行repeat次，取各指标的中位数"""
+    results = {}
+    for scenario in scenarios:
+        for target in targets:
+            runs = [r for r in (run_once(scenario, target) for _ in range(repeat)) if r is not None]
+            if not runs:
+                continue
+            results[f"{scenario}/{target}"] = {
+                metric: statistics.median(run[metric] for run in runs) for metric in METRICS}
+            result = results[f"{scenario}/{target}"]
+            print(f"⏱️ {scenario}/{target}: {result['wall_time']:.2f}秒, 请求{result['requests']:.0f}次, "
+                  f"{result['bytes'] / 1024:.1f}KB, 内存峰值{result['peak_memory'] / 1024 / 1024:.1f}MB")
+    return results
+
+
+def compare(results, baseline, threshold=BENCHMARK_THRESHOLD):
+    """与基准对比，返回超出阈值的项 [(名称, 指标, 基准值, 当前值)]"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        for metric in METRICS:
+            limit = base[metric] * (1 + threshold)
+            if metric == "wall_time":
+                limit += TIME_TOLERANCE
+            if result[metric] > limit:
+                regressions.append((name, metric, base[metric], result[metric]))
+    return regressions
+
+
+def _has_fixtures():
+    import replay
+    return any(os.path.isdir(os.path.join(replay.FIXTURE_DIR, kind)) and os.listdir(os.path.join(replay.FIXTURE_DIR, kind))
+               for kind in ("http", "lib"))
+
+
+def _arg_list(flag, default):
+    if flag in sys.argv:
+        position = sys.argv.index(flag)
+        if position + 1 < len(sys.argv):
+            return [item.strip() for item in sys.argv[position + 1].split(",") if item.strip()]
+    return default
+
+
+def main():
+    if "--worker" in sys.argv:
+        result = run_target(sys.argv[sys.argv.index("--worker") + 1])
+        print(RESULT_PREFIX + json.dumps(result))
+        return 0
+
+    if not _has_fixtures():
+        print("❌ 没有录制的fixture，请先运行: REPLAY_MODE=record python comprehensive_report.py")
+        return 2
+
+    scenarios = _arg_list("--scenarios", list(SCENARIOS))
+    targets = _arg_list("--targets", TARGETS)
+    repeat = int(_arg_list("--repeat", ["3"])[0])
+    unknown = [s for s in scenarios if s not in SCENARIOS] + [t for t in targets if t not in TARGETS]
+    if unknown:
+        print(f"❌ 未知的场景或目标: {', '.join(unknown)}")
+        return 2
+
+    print(f"🏁 基准测试: 场景 {', '.join(scenarios)}，目标 {', '.join(targets)}，每项{repeat}次")
+    results = run_suite(scenarios, targets, repeat)
+
+    if "--save-baseline" in sys.argv:
+        baseline = {}
+        if os.path.exists(BENCHMARK_BASELINE):
+            with open(BENCHMARK_BASELINE, encoding="utf-8") as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        os.makedirs(os.path.dirname(BENCHMARK_BASELINE) or ".", exist_ok=True)
+        with open(BENCHMARK_BASELINE, "w", encoding="utf-8") as f:
+            json.dump(baseline, f, ensure_ascii=False, indent=1)
+        print(f"💾 已保存基准: {BENCHMARK_BASELINE}")
+        return 0
+
+    if not os.path.exists(BENCHMARK_BASELINE):
+        print(f"⚠️ 没有基准文件 {BENCHMARK_BASELINE}，使用 --save-baseline 保存本次结果")
+        return 0
+    with open(BENCHMARK_BASELINE, encoding="utf-8") as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline)
+    if not regressions:
+        print(f"✅ 没有超过基准{BENCHMARK_THRESHOLD:.0%}的退化")
+        return 0
+    print(f"❌ {len(regressions)}项超过基准{BENCHMARK_THRESHOLD:.0%}:")
+    for name, metric, base, current in regressions:
+        print(f"   {name} {metric}: {base:.3f} -> {current:.3f} ({current / base - 1:+.0%})" if base
+              else f"   {name} {metric}: {base:.3f} -> {current:.3f}")
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
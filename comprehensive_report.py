@@ -1,22 +1,34 @@
 # 综合每日报告 - 集成Tushare版本
+import time
+_module_start = time.perf_counter()
+
 import os
+import sys
 import requests
 import json
-from bs4 import BeautifulSoup
-import akshare as ak
-import yfinance as yf
-import pandas as pd
 from datetime import datetime, timedelta
 import traceback
 import concurrent.futures
-import time
+import contextvars
+import threading
 from functools import wraps
-try:
-    import tushare as ts
-    TUSHARE_AVAILABLE = True
-except ImportError:
-    TUSHARE_AVAILABLE = False
-    print("⚠️ Tushare未安装，将使用备用数据源")
+import market_cache
+import http_client
+import wechat_client
+import deadline
+import asyncio
+import async_engine
+import lazy_import
+import metrics
+import report_history
+import replay
+
+# 重量级依赖在对应数据源第一次被调用时才导入
+# 录制/回放模式下替换为对应的代理（见replay.py）
+ak = replay.library("akshare", lazy_import.lazy("akshare"))
+yf = replay.library("yfinance", lazy_import.lazy("yfinance"))
+pd = lazy_import.lazy("pandas")
+np = lazy_import.lazy("numpy")
 
 # 微信公众号测试号配置
 appID = os.environ.get("APP_ID")
@@ -24,15 +36,31 @@ appSecret = os.environ.get("APP_SECRET")
 openId = os.environ.get("OPEN_ID")
 template_id = os.environ.get("TEMPLATE_ID")
 
-# Tushare配置
+# Tushare配置（客户端在第一次使用时初始化）
 tushare_token = os.environ.get("TUSHARE_TOKEN")
-if TUSHARE_AVAILABLE and tushare_token:
-    ts.set_token(tushare_token)
-    pro = ts.pro_api()
-    print("✅ Tushare API已初始化")
-else:
-    pro = None
-    print("⚠️ Tushare不可用，使用备用数据源")
+_pro = None
+_pro_initialized = False
+_pro_lock = threading.Lock()
+
+def get_pro():
+    """获取Tushare pro客户端，未配置Token或未安装时返回None"""
+    global _pro, _pro_initialized
+    with _pro_lock:
+        if not _pro_initialized:
+            _pro_initialized = True
+            if not tushare_token:
+                print("⚠️ Tushare Token未配置，使用备用数据源")
+            elif replay.MODE == "replay":
+                _pro = replay.library("tushare", None)
+            else:
+                try:
+                    ts = lazy_import.timed_import("tushare")
+                    ts.set_token(tushare_token)
+                    _pro = replay.library("tushare", ts.pro_api())
+                    print("✅ Tushare API已初始化")
+                except ImportError:
+                    print("⚠️ Tushare未安装，将使用备用数据源")
+        return _pro
 
 # 和风天气配置
 hefeng_key = os.environ.get("HEFENG_KEY")
@@ -45,25 +73,166 @@ else:
 
 # 全局配置
 REQUEST_TIMEOUT = 10
+FALLBACK_HS300_PE = 13.5
+FALLBACK_BOND_YIELD = "1.799%"  # 使用您提到的主流金融软件显示的值
+
+# 指数日线增量获取（本地保存历史K线，只拉取缺失区间）
+CHINA_INDEX_INCREMENTAL = os.environ.get("CHINA_INDEX_INCREMENTAL", "1") != "0"
+
+# 多数据源获取模式: sequential(逐个尝试) / race(同时发起) / hedge(按间隔错峰发起)
+SOURCE_FETCH_MODE = os.environ.get("SOURCE_FETCH_MODE", "hedge").lower()
+SOURCE_HEDGE_DELAY = float(os.environ.get("SOURCE_HEDGE_DELAY", "1.5"))  # 秒
 
 def timeout_decorator(timeout_seconds):
-    """超时装饰器"""
+    """超时装饰器 - 超过timeout_seconds秒（或上层截止时间）不再等待，返回None"""
     def decorator(func):
         @wraps(func)
         def wrapper(*args, **kwargs):
             start_time = time.time()
             try:
-                result = func(*args, **kwargs)
+                result = deadline.run_with_deadline(func, timeout_seconds, *args, **kwargs)
                 elapsed = time.time() - start_time
                 print(f"⏱️ {func.__name__} 耗时: {elapsed:.2f}秒")
+                metrics.record("fetcher", func.__name__, elapsed, start=start_time,
+                               empty=result is None)
                 return result
+            except deadline.DeadlineExceeded as e:
+                elapsed = time.time() - start_time
+                print(f"⌛ {func.__name__} 超时已放弃 (耗时{elapsed:.2f}秒): {e}")
+                metrics.record("fetcher", func.__name__, elapsed, status="timeout", start=start_time)
+                return None
             except Exception as e:
                 elapsed = time.time() - start_time
                 print(f"❌ {func.__name__} 失败 (耗时{elapsed:.2f}秒): {e}")
+                metrics.record("fetcher", func.__name__, elapsed, status="error", start=start_time,
+                               error=str(e)[:200])
                 return None
         return wrapper
     return decorator
 
+def fetch_from_sources(data_sources, is_valid=bool, mode=None, hedge_delay=None, chain=""):
+    """按优先级从多个数据源获取数据，供同步代码调用
+
+    data_sources 为 (source_name, host, get_func) 列表，返回 (source_name, value)。
+    在独立的事件循环上运行 AsyncEngine.race（调度语义见该方法），继承当前截止时间。
+    """
+    return asyncio.run(async_engine.AsyncEngine().race(
+        data_sources, is_valid=is_valid, mode=(mode or SOURCE_FETCH_MODE).lower(),
+        hedge_delay=SOURCE_HEDGE_DELAY if hedge_delay is None else hedge_delay, chain=chain))
+
+# 和风天气：城市名 -> location ID 查询表与各主机可用的认证方式，保存在本地避免重复查询
+HEFENG_STATE_PATH = replay.state_path(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "qweather_state.json"))
+HEFENG_KNOWN_LOCATIONS = {"惠州": "101280301"}
+HEFENG_QPS = float(os.environ.get("HEFENG_QPS", "5"))
+WEATHER_CITIES = [c.strip() for c in os.environ.get("WEATHER_CITIES", "").split(",") if c.strip()] or ["惠州"]
+
+_hefeng_state = None
+_hefeng_state_lock = threading.Lock()
+# 所有和风天气请求（含GeoAPI城市查询和认证方式重试）共用一个限速器
+_hefeng_limiter = http_client.RateLimiter(HEFENG_QPS)
+
+def _load_hefeng_state():
+    global _hefeng_state
+    if _hefeng_state is None:
+        try:
+            with open(HEFENG_STATE_PATH, encoding="utf-8") as f:
+                _hefeng_state = json.load(f)
+        except (OSError, ValueError):
+            _hefeng_state = {}
+        _hefeng_state.setdefault("locations", {})
+        _hefeng_state.setdefault("auth", {})
+    return _hefeng_state
+
+def _save_hefeng_state():
+    try:
+        os.makedirs(os.path.dirname(HEFENG_STATE_PATH), exist_ok=True)
+        with open(HEFENG_STATE_PATH, "w", encoding="utf-8") as f:
+            json.dump(_hefeng_state, f, ensure_ascii=False)
+    except OSError as e:
+        print(f"⚠️ 保存和风天气查询表失败: {e}")
+
+def hefeng_auth_methods(params):
+    """两种认证方式，本主机上次成功的方式排在前面"""
+    methods = [
+        # 方法1: Bearer Token 认证（新版API推荐）
+        {
+            "name": "bearer",
+            "headers": {"Authorization": f"Bearer {hefeng_key}"},
+            "params": dict(params),
+            "description": "Bearer Token认证"
+        },
+        # 方法2: Key 参数认证（传统方式）
+        {
+            "name": "key",
+            "headers": {},
+            "params": dict(params, key=hefeng_key),
+            "description": "Key参数认证"
+        }
+    ]
+    with _hefeng_state_lock:
+        preferred = _load_hefeng_state()["auth"].get(hefeng_host)
+    methods.sort(key=lambda method: method["name"] != preferred)
+    return methods
+
+def _remember_hefeng_auth(method_name):
+    with _hefeng_state_lock:
+        state = _load_hefeng_state()
+        if state["auth"].get(hefeng_host) != method_name:
+            state["auth"][hefeng_host] = method_name
+            _save_hefeng_state()
+
+def hefeng_get(url, params):
+    """按认证方式依次请求和风天气接口（每次请求都经过HEFENG_QPS限速），返回 code=200 的响应JSON"""
+    last_error = None
+    for method in hefeng_auth_methods(params):
+        try:
+            _hefeng_limiter.acquire()
+            print(f"🔍 {method['description']}: {url} {method['params'].get('location')}")
+            response = http_client.get(url, params=method['params'], headers=method['headers'],
+                                       timeout=REQUEST_TIMEOUT)
+            if response.status_code != 200:
+                last_error = f"HTTP {response.status_code}: {response.text[:200]}"
+            else:
+                data = response.json()
+                if data.get('code') == '200':
+                    _remember_hefeng_auth(method["name"])
+                    return data
+                last_error = f"和风天气API返回错误: code={data.get('code')}, 错误信息={data.get('msg', 'N/A')}"
+        except requests.exceptions.RequestException as e:
+            last_error = f"请求异常: {e}"
+        except Exception as e:
+            last_error = f"处理异常: {e}"
+        print(f"❌ {method['description']}失败: {last_error}")
+    
+    # 所有方法都失败
+    raise Exception(f"所有认证方法都失败，最后错误: {last_error}")
+
+def resolve_location_id(city_name):
+    """城市名转和风天气location ID，优先使用内置表和本地查询表"""
+    if city_name in HEFENG_KNOWN_LOCATIONS:
+        return HEFENG_KNOWN_LOCATIONS[city_name]
+    with _hefeng_state_lock:
+        location_id = _load_hefeng_state()["locations"].get(city_name)
+    if location_id:
+        return location_id
+    
+    # 免费版使用独立的GeoAPI主机，专属API Host使用 /geo 路径
+    if hefeng_host == "devapi.qweather.com":
+        url = "https://geoapi.qweather.com/v2/city/lookup"
+    else:
+        url = f"https://{hefeng_host}/geo/v2/city/lookup"
+    data = hefeng_get(url, {"location": city_name, "number": 1})
+    locations = data.get('location') or []
+    if not locations:
+        raise Exception(f"和风天气找不到城市: {city_name}")
+    location_id = locations[0]['id']
+    with _hefeng_state_lock:
+        _load_hefeng_state()["locations"][city_name] = location_id
+        _save_hefeng_state()
+    print(f"📍 {city_name} location ID: {location_id}")
+    return location_id
+
 @timeout_decorator(15)
 def get_weather_from_hefeng(city_name="惠州", location_id="101280301"):
     """使用和风天气API获取准确天气数据"""
@@ -74,82 +243,18 @@ def get_weather_from_hefeng(city_name="惠州", location_id="101280301"):
         print(f"🔍 从和风天气获取{city_name}天气数据...")
         
         # 和风天气实时天气API - 支持多种认证方式
-        url = f"https://{hefeng_host}/v7/weather/now"
-        
-        # 尝试两种认证方式
-        auth_methods = [
-            # 方法1: Bearer Token 认证（新版API推荐）
-            {
-                "headers": {"Authorization": f"Bearer {hefeng_key}"},
-                "params": {"location": location_id, "gzip": "n"},
-                "description": "Bearer Token认证"
-            },
-            # 方法2: Key 参数认证（传统方式）
-            {
-                "headers": {},
-                "params": {"location": location_id, "key": hefeng_key, "gzip": "n"},
-                "description": "Key参数认证"
-            }
-        ]
-        
-        last_error = None
+        data = hefeng_get(f"https://{hefeng_host}/v7/weather/now", {"location": location_id, "gzip": "n"})
+        now_data = data.get('now', {})
         
-        for i, method in enumerate(auth_methods, 1):
-            try:
-                print(f"🔍 尝试方法{i}: {method['description']}")
-                print(f"🔍 请求URL: {url}")
-                print(f"🔍 请求参数: {method['params']}")
-                
-                response = requests.get(
-                    url, 
-                    params=method['params'],
-                    headers=method['headers'],
-                    timeout=REQUEST_TIMEOUT
-                )
-                
-                print(f"📊 HTTP状态码: {response.status_code}")
-                print(f"📋 响应头: {dict(response.headers)}")
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    print(f"📋 和风天气API响应: {data}")
-                    
-                    if data.get('code') == '200':
-                        now_data = data.get('now', {})
-                        
-                        # 提取天气信息
-                        temp = f"{now_data.get('temp', 'N/A')}°C"
-                        weather_text = now_data.get('text', 'N/A')
-                        wind_dir = now_data.get('windDir', 'N/A')
-                        wind_scale = now_data.get('windScale', 'N/A')
-                        wind = f"{wind_dir}{wind_scale}级"
-                        
-                        print(f"✅ 成功获取{city_name}天气: {weather_text} {temp} {wind}")
-                        return city_name, temp, weather_text, wind
-                    else:
-                        error_msg = f"和风天气API返回错误: code={data.get('code')}, 错误信息={data.get('msg', 'N/A')}"
-                        print(f"❌ {method['description']}失败: {error_msg}")
-                        last_error = error_msg
-                        continue
-                else:
-                    error_msg = f"HTTP {response.status_code}: {response.text[:200]}"
-                    print(f"❌ {method['description']}失败: {error_msg}")
-                    last_error = error_msg
-                    continue
-                    
-            except requests.exceptions.RequestException as e:
-                error_msg = f"请求异常: {e}"
-                print(f"❌ {method['description']}失败: {error_msg}")
-                last_error = error_msg
-                continue
-            except Exception as e:
-                error_msg = f"处理异常: {e}"
-                print(f"❌ {method['description']}失败: {error_msg}")
-                last_error = error_msg
-                continue
+        # 提取天气信息
+        temp = f"{now_data.get('temp', 'N/A')}°C"
+        weather_text = now_data.get('text', 'N/A')
+        wind_dir = now_data.get('windDir', 'N/A')
+        wind_scale = now_data.get('windScale', 'N/A')
+        wind = f"{wind_dir}{wind_scale}级"
         
-        # 所有方法都失败
-        raise Exception(f"所有认证方法都失败，最后错误: {last_error}")
+        print(f"✅ 成功获取{city_name}天气: {weather_text} {temp} {wind}")
+        return city_name, temp, weather_text, wind
             
     except Exception as e:
         if "所有认证方法" in str(e):
@@ -158,33 +263,94 @@ def get_weather_from_hefeng(city_name="惠州", location_id="101280301"):
         print(f"❌ {error_msg}")
         raise Exception(error_msg)
 
+def get_weather_for_cities(city_names=None):
+    """限速并发获取多个城市的天气
+
+    返回 {城市: (城市, 温度, 天气, 风向)}，按city_names顺序排列，获取失败的城市不在结果中。
+    """
+    city_names = city_names or WEATHER_CITIES
+    if not hefeng_key:
+        print("❌ 和风天气API Key未配置，请设置HEFENG_KEY环境变量")
+        return {}
+    
+    def fetch_city(city_name):
+        try:
+            location_id = resolve_location_id(city_name)
+            return get_weather_from_hefeng(city_name, location_id)
+        except Exception as e:
+            print(f"❌ {city_name}天气获取失败: {e}")
+            return None
+    
+    # 线程池线程不继承contextvars，每个任务在调用方上下文的副本中运行，以便遵守当前截止时间和取消
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(8, len(city_names))) as executor:
+        futures = [executor.submit(contextvars.copy_context().run, fetch_city, city_name)
+                   for city_name in city_names]
+        weather_rows = [future.result() for future in futures]
+    
+    weather_table = {city: row for city, row in zip(city_names, weather_rows) if row}
+    for city, temp, weather_text, wind in weather_table.values():
+        print(f"🌤️ {city}: {weather_text} {temp} {wind}")
+    return weather_table
+
 @timeout_decorator(20)
 def get_weather(city_name="惠州"):
-    """获取惠州天气信息 - 使用和风天气API"""
+    """获取单个城市天气信息 - 使用和风天气API"""
     print(f"🌤️ 开始获取{city_name}天气信息...")
     
-    # 惠州的location ID（和风天气）
-    location_id = "101280301"
-    
-    try:
-        weather_data = get_weather_from_hefeng(city_name, location_id)
-        return weather_data
-    except Exception as e:
-        print(f"❌ 天气获取失败: {e}")
+    weather_data = get_weather_for_cities([city_name]).get(city_name)
+    if weather_data is None:
         # 不再返回默认值，而是抛出异常
-        raise Exception(f"无法获取{city_name}的天气数据: {e}")
+        raise Exception(f"无法获取{city_name}的天气数据")
+    return weather_data
+
+def project_frame(frame, columns, float_dtype="float32"):
+    """只保留需要的列并压缩类型，在缓存和读取之前调用
+
+    columns 为 {列名: 类型}：float（数值，降为float_dtype）、date（datetime64）、
+    category（分类）或 None（原样复制）。返回的DataFrame不引用原始数据，原始大表随即可被释放。
+    缺少的列直接跳过，由调用方按原逻辑判断。
+    """
+    if frame is None or frame.empty:
+        return frame
+    projected = {}
+    for column, kind in columns.items():
+        if column not in frame.columns:
+            continue
+        series = frame[column]
+        if kind == "float":
+            projected[column] = pd.to_numeric(series, errors='coerce').to_numpy(dtype=float_dtype)
+        elif kind == "date":
+            projected[column] = pd.to_datetime(series, errors='coerce').to_numpy()
+        elif kind == "category":
+            projected[column] = pd.Categorical(series)
+        else:
+            projected[column] = series.to_numpy(copy=True)
+    return pd.DataFrame(projected)
+
+def load_hs300_pe_lg():
+    """理杏仁沪深300估值历史，只保留日期和滚动市盈率"""
+    return market_cache.cached_fetch(
+        "akshare", "stock_index_pe_lg:沪深300",
+        lambda: project_frame(ak.stock_index_pe_lg(symbol='沪深300'),
+                              {'日期': 'date', '滚动市盈率': 'float'}))
+
+def load_bond_zh_us_rate():
+    """中美国债收益率历史，只保留日期和中国10年期收益率"""
+    return market_cache.cached_fetch(
+        "akshare", "bond_zh_us_rate",
+        lambda: project_frame(ak.bond_zh_us_rate(), {'日期': 'date', '中国国债收益率10年': 'float'}))
 
 def get_pe_from_akshare_lgm():
     """理杏仁获取沪深300准确PE值"""
     try:
         print("🔍 从理杏仁获取沪深300 PE值...")
-        pe_data = ak.stock_index_pe_lg(symbol='沪深300')
+        pe_data = load_hs300_pe_lg()
         if not pe_data.empty:
             latest = pe_data.iloc[-1]
             # 使用滚动市盈率(更准确)
             pe_value = latest.get('滚动市盈率')
             if pe_value and pd.notna(pe_value) and pe_value > 0:
-                pe_float = float(pe_value)
+                pe_float = round(float(pe_value), 4)
                 if 5 < pe_float < 30:  # 调整合理范围
                     print(f"✅ 理杏仁滚动PE: {pe_float}")
                     return pe_float
@@ -197,13 +363,16 @@ def get_pe_from_csindex():
     """中证指数官方获取沪深300 PE值"""
     try:
         print("🔍 从中证指数获取沪深300 PE值...")
-        csindex_data = ak.stock_zh_index_value_csindex(symbol='000300')
+        csindex_data = market_cache.cached_fetch(
+            "akshare", "stock_zh_index_value_csindex:000300",
+            lambda: project_frame(ak.stock_zh_index_value_csindex(symbol='000300'),
+                                  {'日期': 'date', '市盈率1': 'float'}))
         if not csindex_data.empty:
             latest = csindex_data.iloc[-1]
             # 使用市盈率1(静态市盈率)
             pe_value = latest.get('市盈率1')
             if pe_value and pd.notna(pe_value) and pe_value > 0:
-                pe_float = float(pe_value)
+                pe_float = round(float(pe_value), 4)
                 if 5 < pe_float < 30:
                     print(f"✅ 中证指数PE: {pe_float}")
                     return pe_float
@@ -234,7 +403,7 @@ def get_pe_from_xueqiu():
         }
         
         print("🔍 从雪球获取沪深300 PE值...")
-        response = requests.get(url, params=params, headers=headers, timeout=REQUEST_TIMEOUT)
+        response = http_client.get(url, params=params, headers=headers, timeout=REQUEST_TIMEOUT)
         if response.status_code == 200:
             data = response.json()
             if 'data' in data and 'quote' in data['data']:
@@ -250,6 +419,7 @@ def get_pe_from_xueqiu():
 @timeout_decorator(15)
 def get_pe_from_tushare():
     """从Tushare获取沪深300准确PE值（权威数据源）"""
+    pro = get_pro()
     if not pro:
         return None
     
@@ -286,38 +456,65 @@ def get_pe_from_tushare():
         print(f"Tushare PE获取异常: {e}")
         return None
 
+def pe_data_sources():
+    """沪深300 PE数据源，按优先级排列：(名称, 主机, 获取函数)"""
+    # 数据源优先级：Tushare（最权威） > 理杏仁 > 中证指数 > 雪球 > 东方财富
+    data_sources = [
+        ("理杏仁", "akshare", get_pe_from_akshare_lgm),
+        ("中证指数", "akshare", get_pe_from_csindex),
+        ("雪球", "stock.xueqiu.com", get_pe_from_xueqiu),
+        ("东方财富", "eastmoney", get_pe_from_eastmoney)
+    ]
+    if tushare_token:
+        data_sources.insert(0, ("Tushare", "tushare", get_pe_from_tushare))
+    return data_sources
+
+def is_valid_pe(pe_value):
+    return pe_value > 0
+
 @timeout_decorator(25)
 def get_hs300_pe_ratio():
     """获取沪深300精确PE值 - 优先使用Tushare"""
     print("🎯 开始获取沪深300精确PE值...")
     
-    # 优先使用Tushare（最权威）
-    if pro:
-        pe_value = get_pe_from_tushare()
-        if pe_value:
-            print(f"✅ 成功从Tushare获取PE值: {pe_value}")
-            return pe_value
-    
-    # 备用数据源
-    data_sources = [
-        ("理杏仁", get_pe_from_akshare_lgm),
-        ("中证指数", get_pe_from_csindex),
-        ("雪球", get_pe_from_xueqiu),
-        ("东方财富", get_pe_from_eastmoney)
-    ]
+    source_name, pe_value = fetch_from_sources(pe_data_sources(), is_valid=is_valid_pe, chain="hs300_pe")
+    if pe_value:
+        print(f"✅ 成功从{source_name}获取PE值: {pe_value}")
+        return pe_value
     
-    for source_name, get_func in data_sources:
+    # 所有方案都失败，抛出异常
+    raise Exception("无法获取沪深300 PE值，所有数据源都失败")
+
+def fetch_index_range(symbol, start_date, end_date):
+    """按日期区间获取指数日线（只下载缺失的几行），K线写入本地存储，因此保持float64"""
+    return project_frame(
+        ak.stock_zh_index_daily_em(symbol=symbol, start_date=start_date, end_date=end_date),
+        {'date': 'date', 'open': 'float', 'high': 'float', 'low': 'float', 'close': 'float', 'volume': 'float'},
+        float_dtype="float64")
+
+def get_index_tail(symbol, n=2):
+    """获取指数最近n个交易日的日线，优先使用本地增量存储"""
+    if CHINA_INDEX_INCREMENTAL:
         try:
-            pe_value = get_func()
-            if pe_value and pe_value > 0:
-                print(f"✅ 成功从{source_name}获取PE值: {pe_value}")
-                return pe_value
+            tail = market_cache.index_history_tail(symbol, fetch_index_range, n=n)
+            if tail is not None and len(tail) >= min(n, 2):
+                return tail
         except Exception as e:
-            print(f"❌ {source_name}获取失败: {e}")
-            continue
+            print(f"⚠️ {symbol}增量获取失败，改用全量日线: {e}")
     
-    # 所有方案都失败，抛出异常
-    raise Exception("无法获取沪深300 PE值，所有数据源都失败")
+    data = market_cache.cached_fetch(
+        "akshare", f"stock_zh_index_daily:{symbol}",
+        lambda: project_frame(ak.stock_zh_index_daily(symbol=symbol), {'date': 'date', 'close': 'float'}))
+    return data.tail(n) if data is not None else None
+
+def format_index_quote(data):
+    """根据最近两根日线生成 "收盘价 (涨跌幅%)" 文本"""
+    if data is None or data.empty:
+        return '获取失败'
+    latest = data.iloc[-1]
+    prev = data.iloc[-2] if len(data) > 1 else latest
+    change = ((latest['close'] - prev['close']) / prev['close'] * 100)
+    return f"{latest['close']:.2f} ({change:+.2f}%)"
 
 @timeout_decorator(25)
 def get_china_stock_data():
@@ -331,12 +528,7 @@ def get_china_stock_data():
         
         for symbol, name in zip(symbols, names):
             try:
-                data = ak.stock_zh_index_daily(symbol=symbol)
-                if not data.empty:
-                    latest = data.iloc[-1]
-                    prev = data.iloc[-2] if len(data) > 1 else latest
-                    change = ((latest['close'] - prev['close']) / prev['close'] * 100)
-                    stock_data[name] = f"{latest['close']:.2f} ({change:+.2f}%)"
+                stock_data[name] = format_index_quote(get_index_tail(symbol))
             except Exception as e:
                 stock_data[name] = '获取失败'
         
@@ -345,17 +537,18 @@ def get_china_stock_data():
             stock_data['hs300_pe'] = get_hs300_pe_ratio()
         except Exception as e:
             print(f"PE值获取失败: {e}")
-            stock_data['hs300_pe'] = 13.5  # 使用默认值作为最后的fallback
+            stock_data['hs300_pe'] = FALLBACK_HS300_PE  # 使用默认值作为最后的fallback
         
         return stock_data
     
     except Exception as e:
         print(f"股市数据获取出错: {e}")
-        return {'sh_index': '获取失败', 'hs300_index': '获取失败', 'hs300_pe': 13.5}
+        return {'sh_index': '获取失败', 'hs300_index': '获取失败', 'hs300_pe': FALLBACK_HS300_PE}
 
 @timeout_decorator(15)
 def get_bond_from_tushare():
     """优先尝试从Tushare获取中国10年期国债收益率"""
+    pro = get_pro()
     if not pro:
         return None
     
@@ -461,7 +654,7 @@ def get_bond_from_eastmoney():
                 'Referer': 'https://finance.sina.com.cn/'
             }
             
-            response = requests.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+            response = http_client.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
             
             if response.status_code == 200:
                 data = response.text
@@ -488,13 +681,13 @@ def get_bond_from_akshare():
     try:
         print("🔍 从AKShare获取中国10年期国债收益率...")
         
-        bond_data = ak.bond_zh_us_rate()
+        bond_data = load_bond_zh_us_rate()
         
         if not bond_data.empty and '中国国债收益率10年' in bond_data.columns:
             china_10y_series = bond_data['中国国债收益率10年'].dropna()
             if not china_10y_series.empty:
                 cn_10y = china_10y_series.iloc[-1]
-                print(f"✅ AKShare 10年期国债收益率: {cn_10y}%")
+                print(f"✅ AKShare 10年期国债收益率: {float(cn_10y):.3f}%")
                 return f"{float(cn_10y):.3f}%"
         
         return None
@@ -503,87 +696,97 @@ def get_bond_from_akshare():
         print(f"AKShare债券数据获取异常: {e}")
         return None
 
+def bond_data_sources():
+    """中国10年期国债收益率数据源，按优先级排列：(名称, 主机, 获取函数)"""
+    # 数据源优先级：Tushare > 东方财富 > Yahoo Finance > AKShare
+    return [
+        ("Tushare", "tushare", get_bond_from_tushare),
+        ("东方财富", "eastmoney", get_bond_from_eastmoney),
+        ("Yahoo Finance", "yahoo", get_bond_from_yahoo), 
+        ("AKShare", "akshare", get_bond_from_akshare)
+    ]
+
 @timeout_decorator(20)
 def get_bond_data():
     """获取中国10年期国债收益率 - 多数据源优先级获取"""
     print("📊 开始获取中国10年期国债收益率...")
     
-    # 数据源优先级：Tushare > 东方财富 > Yahoo Finance > AKShare
-    data_sources = [
-        ("Tushare", get_bond_from_tushare),
-        ("东方财富", get_bond_from_eastmoney),
-        ("Yahoo Finance", get_bond_from_yahoo), 
-        ("AKShare", get_bond_from_akshare)
-    ]
-    
-    for source_name, get_func in data_sources:
-        try:
-            bond_yield = get_func()
-            if bond_yield:
-                print(f"✅ 成功从{source_name}获取债券收益率: {bond_yield}")
-                return bond_yield
-        except Exception as e:
-            print(f"❌ {source_name}获取失败: {e}")
-            continue
+    source_name, bond_yield = fetch_from_sources(bond_data_sources(), chain="bond")
+    if bond_yield:
+        print(f"✅ 成功从{source_name}获取债券收益率: {bond_yield}")
+        return bond_yield
     
     # 所有数据源都失败，使用合理估算值
-    fallback_yield = "1.799%"  # 使用您提到的主流金融软件显示的值
+    fallback_yield = FALLBACK_BOND_YIELD
     print(f"⚠️ 所有数据源获取失败，使用合理估算值: {fallback_yield}")
     return fallback_yield
 
+# Yahoo Finance 批量行情：美股指数、加密货币、汇率
+YAHOO_SYMBOLS = ["^DJI", "^IXIC", "^GSPC", "BTC-USD", "ETH-USD", "USDCNY=X"]
+
+_yahoo_quotes_lock = threading.Lock()
+_yahoo_quotes = None
+
+def fetch_yahoo_quotes(symbols=YAHOO_SYMBOLS):
+    """一次批量下载所有Yahoo品种，返回以symbol为索引的DataFrame(last, prev, change_pct)"""
+    print(f"🔍 批量获取Yahoo行情: {', '.join(symbols)}")
+    data = yf.download(list(symbols), period="5d", interval="1d", auto_adjust=True,
+                       progress=False, threads=True, timeout=REQUEST_TIMEOUT)
+    if data is None or data.empty:
+        return pd.DataFrame(columns=['last', 'prev', 'change_pct'])
+    
+    close = data['Close']
+    if isinstance(close, pd.Series):
+        close = close.to_frame(symbols[0])
+    close = close.reindex(columns=list(symbols)).astype(float)
+    
+    # 各品种交易日不同（加密货币周末也有数据），按列取最后两个有效收盘价
+    valid = close.notna()
+    rank_from_end = valid.iloc[::-1].cumsum().iloc[::-1]
+    last = close.where(valid & (rank_from_end == 1)).max()
+    prev = close.where(valid & (rank_from_end == 2)).max().fillna(last)
+    
+    quotes = pd.DataFrame({'last': last, 'prev': prev})
+    quotes['change_pct'] = (quotes['last'] - quotes['prev']) / quotes['prev'] * 100
+    return quotes.dropna(subset=['last'])
+
+def get_yahoo_quotes():
+    """获取本次运行共享的Yahoo批量行情（多个获取函数并发调用时只下载一次）"""
+    global _yahoo_quotes
+    with _yahoo_quotes_lock:
+        if _yahoo_quotes is None:
+            _yahoo_quotes = market_cache.cached_fetch(
+                "yahoo", "download:" + ",".join(YAHOO_SYMBOLS), fetch_yahoo_quotes)
+        return _yahoo_quotes
+
 @timeout_decorator(30)
 def get_us_stock_data():
     """获取美股指数数据"""
+    symbols = {"^DJI": "dji", "^IXIC": "nasdaq", "^GSPC": "sp500"}
     try:
-        us_data = {}
-        symbols = {"^DJI": "dji", "^IXIC": "nasdaq", "^GSPC": "sp500"}
-        
-        for symbol, name in symbols.items():
-            try:
-                print(f"🔍 获取{name.upper()}数据...")
-                ticker = yf.Ticker(symbol)
-                
-                # 获取最近两天的数据来计算涨跌幅
-                hist = ticker.history(period="5d")  # 获取5天数据确保有足够的交易日
-                if not hist.empty and len(hist) >= 1:
-                    current = float(hist['Close'].iloc[-1])
-                    
-                    # 计算涨跌幅
-                    if len(hist) > 1:
-                        prev = float(hist['Close'].iloc[-2])
-                        change_pct = ((current - prev) / prev) * 100
-                    else:
-                        change_pct = 0
-                    
-                    if change_pct >= 0:
-                        us_data[name] = f"{current:.2f} (+{change_pct:.2f}%)"
-                    else:
-                        us_data[name] = f"{current:.2f} ({change_pct:.2f}%)"
-                    
-                    print(f"✅ {name.upper()}: {current:.2f} ({change_pct:+.2f}%)")
-                else:
-                    us_data[name] = '获取失败'
-                    print(f"❌ {name.upper()}: 数据为空")
-                    
-            except Exception as e:
-                print(f"❌ {name.upper()}获取失败: {e}")
-                us_data[name] = '获取失败'
-        
-        return us_data
-    
+        quotes = get_yahoo_quotes()
     except Exception as e:
         print(f"美股数据获取出错: {e}")
-        return {'dji': '获取失败', 'nasdaq': '获取失败', 'sp500': '获取失败'}
+        return {name: '获取失败' for name in symbols.values()}
+    
+    us_data = {}
+    for symbol, name in symbols.items():
+        if symbol in quotes.index:
+            current, change_pct = quotes.at[symbol, 'last'], quotes.at[symbol, 'change_pct']
+            us_data[name] = f"{current:.2f} ({change_pct:+.2f}%)"
+            print(f"✅ {name.upper()}: {current:.2f} ({change_pct:+.2f}%)")
+        else:
+            us_data[name] = '获取失败'
+            print(f"❌ {name.upper()}: 数据为空")
+    return us_data
 
 @timeout_decorator(15)
 def get_exchange_rate():
     """获取人民币兑美元汇率"""
     try:
-        usdcny = yf.download("USDCNY=X", period="1d", interval="1d", 
-                           auto_adjust=True, progress=False, timeout=REQUEST_TIMEOUT)
-        if not usdcny.empty and len(usdcny) >= 1:
-            latest_rate = usdcny['Close'].iloc[-1].item()
-            return f"{latest_rate:.4f}"
+        quotes = get_yahoo_quotes()
+        if "USDCNY=X" in quotes.index:
+            return f"{quotes.at['USDCNY=X', 'last']:.4f}"
     except Exception as e:
         print(f"汇率数据获取出错: {e}")
     
@@ -592,45 +795,23 @@ def get_exchange_rate():
 @timeout_decorator(20)
 def get_crypto_data():
     """获取加密货币价格"""
+    symbols = {"BTC-USD": "bitcoin", "ETH-USD": "ethereum"}
     try:
-        crypto_data = {}
-        symbols = {"BTC-USD": "bitcoin", "ETH-USD": "ethereum"}
-        
-        for symbol, name in symbols.items():
-            try:
-                print(f"🔍 获取{name}数据...")
-                ticker = yf.Ticker(symbol)
-                
-                # 优先使用fast_info获取实时价格
-                try:
-                    fast_info = ticker.fast_info
-                    if hasattr(fast_info, 'last_price') and fast_info.last_price:
-                        price = float(fast_info.last_price)
-                        crypto_data[name] = f"${price:,.0f}"
-                        print(f"✅ {name}实时价格: ${price:,.0f}")
-                        continue
-                except:
-                    pass
-                
-                # 备用方法：使用历史数据
-                hist = ticker.history(period="1d")
-                if not hist.empty:
-                    price = float(hist['Close'].iloc[-1])
-                    crypto_data[name] = f"${price:,.0f}"
-                    print(f"✅ {name}历史价格: ${price:,.0f}")
-                else:
-                    crypto_data[name] = '获取失败'
-                    print(f"❌ {name}数据为空")
-                    
-            except Exception as e:
-                print(f"❌ {name}获取失败: {e}")
-                crypto_data[name] = '获取失败'
-        
-        return crypto_data
-    
+        quotes = get_yahoo_quotes()
     except Exception as e:
         print(f"加密货币数据获取出错: {e}")
-        return {'bitcoin': '获取失败', 'ethereum': '获取失败'}
+        return {name: '获取失败' for name in symbols.values()}
+    
+    crypto_data = {}
+    for symbol, name in symbols.items():
+        if symbol in quotes.index:
+            price = quotes.at[symbol, 'last']
+            crypto_data[name] = f"${price:,.0f}"
+            print(f"✅ {name}价格: ${price:,.0f}")
+        else:
+            crypto_data[name] = '获取失败'
+            print(f"❌ {name}数据为空")
+    return crypto_data
 
 def calculate_risk_premium(hs300_pe, bond_yield_str):
     """计算沪深300风险溢价"""
@@ -647,176 +828,397 @@ def calculate_risk_premium(hs300_pe, bond_yield_str):
         print(f"风险溢价计算出错: {e}")
         return "计算失败"
 
+# 风险溢价历史分位的统计窗口（年）
+RISK_PREMIUM_HISTORY_YEARS = int(os.environ.get("RISK_PREMIUM_HISTORY_YEARS", "5"))
+
+# 日常运行只需要最近几个交易日的PE和收益率，按该窗口（天）获取
+RISK_PREMIUM_LATEST_DAYS = 14
+
+def _lg_pe_frame(pe_data):
+    return pd.DataFrame({"date": pd.to_datetime(pe_data['日期']),
+                         "pe": pd.to_numeric(pe_data['滚动市盈率'], errors='coerce')})
+
+def _tushare_pe_frame(start_date):
+    """Tushare沪深300每日指标中的滚动市盈率 DataFrame(date, pe)，未配置Token或无数据返回None"""
+    pro = get_pro()
+    if not pro:
+        return None
+    daily_basic = market_cache.cached_fetch(
+        "tushare", f"index_dailybasic:000300.SH:{start_date}",
+        lambda: project_frame(
+            pro.index_dailybasic(ts_code='000300.SH', start_date=start_date,
+                                 end_date=datetime.now().strftime('%Y%m%d')),
+            {'trade_date': None, 'pe_ttm': 'float', 'pe': 'float'}))
+    if daily_basic is None or daily_basic.empty:
+        return None
+    pe_column = 'pe_ttm' if 'pe_ttm' in daily_basic.columns else 'pe'
+    return pd.DataFrame({"date": pd.to_datetime(daily_basic['trade_date'], format='%Y%m%d'),
+                         "pe": pd.to_numeric(daily_basic[pe_column], errors='coerce')})
+
+def _bond_frame(bond_data):
+    return pd.DataFrame({"date": pd.to_datetime(bond_data['日期']),
+                         "bond_yield": pd.to_numeric(bond_data['中国国债收益率10年'], errors='coerce')})
+
+def fetch_pe_history():
+    """沪深300滚动市盈率日序列 DataFrame(date, pe)，理杏仁优先，失败时使用Tushare"""
+    try:
+        pe_data = load_hs300_pe_lg()
+        if not pe_data.empty:
+            return _lg_pe_frame(pe_data)
+    except Exception as e:
+        print(f"理杏仁PE历史获取异常: {e}")
+    
+    return _tushare_pe_frame(
+        (datetime.now() - timedelta(days=int(365.25 * RISK_PREMIUM_HISTORY_YEARS) + 30)).strftime('%Y%m%d'))
+
+def fetch_bond_history():
+    """中国10年期国债收益率日序列 DataFrame(date, bond_yield)，单位为百分比"""
+    bond_data = load_bond_zh_us_rate()
+    if bond_data.empty or '中国国债收益率10年' not in bond_data.columns:
+        return None
+    return _bond_frame(bond_data)
+
+def fetch_latest_pe(days=RISK_PREMIUM_LATEST_DAYS):
+    """最近days天的沪深300滚动市盈率 DataFrame(date, pe)，不下载全量历史
+
+    本次运行中PE链路已经下载过理杏仁全量表时直接复用缓存，否则取Tushare的短窗口。
+    """
+    since = datetime.now() - timedelta(days=days)
+    pe_data = market_cache.get("akshare", "stock_index_pe_lg:沪深300")
+    if pe_data is not None and not pe_data.empty:
+        frame = _lg_pe_frame(pe_data)
+        return frame[frame["date"] >= since]
+    return _tushare_pe_frame(since.strftime('%Y%m%d'))
+
+def fetch_latest_bond(days=RISK_PREMIUM_LATEST_DAYS):
+    """最近days天的中国10年期国债收益率 DataFrame(date, bond_yield)，不下载全量历史
+
+    优先复用本次运行已缓存的中美国债收益率全量表，否则按日期区间查询中债国债收益率曲线（同一口径）。
+    """
+    since = datetime.now() - timedelta(days=days)
+    bond_data = market_cache.get("akshare", "bond_zh_us_rate")
+    if bond_data is not None and not bond_data.empty and '中国国债收益率10年' in bond_data.columns:
+        frame = _bond_frame(bond_data)
+        return frame[frame["date"] >= since]
+    start_date, end_date = since.strftime('%Y%m%d'), datetime.now().strftime('%Y%m%d')
+    curves = market_cache.cached_fetch(
+        "akshare", f"bond_china_yield:{start_date}",
+        lambda: project_frame(ak.bond_china_yield(start_date=start_date, end_date=end_date),
+                              {'曲线名称': 'category', '日期': 'date', '10年': 'float'}))
+    if curves is None or curves.empty:
+        return None
+    treasury = curves[curves['曲线名称'] == '中债国债收益率曲线']
+    return pd.DataFrame({"date": pd.to_datetime(treasury['日期']),
+                         "bond_yield": pd.to_numeric(treasury['10年'], errors='coerce')})
+
+def risk_premium_series(pe_history, bond_history, tolerance_days=7):
+    """整段历史的风险溢价序列（与calculate_risk_premium的口径一致，单位为百分比）
+
+    PE和国债收益率的交易日不完全相同，按日期as-of对齐：每个PE日期取不晚于它、
+    且相差不超过tolerance_days天的最近一个收益率。返回 DataFrame(date, hs300_pe, bond_yield, risk_premium)。
+    """
+    pe_history = pe_history.dropna().sort_values("date")
+    bond_history = bond_history.dropna().sort_values("date")
+    merged = pd.merge_asof(pe_history, bond_history, on="date", direction="backward",
+                           tolerance=pd.Timedelta(days=tolerance_days))
+    pe = merged["pe"].to_numpy(dtype=float)
+    bond_yield = merged["bond_yield"].to_numpy(dtype=float)
+    valid = (pe > 0) & ~np.isnan(bond_yield)
+    pe, bond_yield = pe[valid], bond_yield[valid]
+    return pd.DataFrame({
+        "date": merged["date"].to_numpy()[valid],
+        "hs300_pe": pe,
+        "bond_yield": bond_yield,
+        "risk_premium": 100.0 / pe - bond_yield,
+    })
+
+def update_risk_premium_history(years=RISK_PREMIUM_HISTORY_YEARS):
+    """返回历史序列口径的最新风险溢价 {date, hs300_pe, bond_yield, risk_premium}，获取失败返回None
+
+    date 为PE数据自身的交易日。本地风险溢价日序列覆盖不足years年或中断超过一周时，
+    下载一次PE和国债收益率全量历史补齐；否则只获取最近几个交易日（见fetch_latest_pe、
+    fetch_latest_bond），由当日运行按交易日追加一行。
+    关闭运行记录（REPORT_HISTORY=0）时没有历史可比，直接返回None，不下载任何数据。
+    """
+    if not report_history.HISTORY_ENABLED:
+        return None
+    count, first, last = report_history.risk_premium_coverage()
+    now = datetime.now()
+    covered = (first is not None and first <= now - timedelta(days=int(365.25 * years) - 30)
+               and last >= now - timedelta(days=7))
+    if covered:
+        pe_history, bond_history = fetch_latest_pe(), fetch_latest_bond()
+    else:
+        print(f"📚 补齐风险溢价历史（本地{count}天）...")
+        pe_history, bond_history = fetch_pe_history(), fetch_bond_history()
+    if pe_history is None or bond_history is None:
+        print("⚠️ PE或国债收益率历史获取失败，跳过风险溢价历史")
+        return None
+    series = risk_premium_series(pe_history, bond_history)
+    if series.empty:
+        return None
+    
+    if not covered:
+        added = report_history.backfill_risk_premium(
+            series[series["date"] >= now - timedelta(days=int(365.25 * years))], "history")
+        print(f"✅ 风险溢价历史新增{added}天")
+    return series.iloc[-1].to_dict()
+
+def format_risk_premium(risk_premium, risk_point, years=RISK_PREMIUM_HISTORY_YEARS):
+    """在风险溢价后附上近years年历史分位，历史不足时原样返回
+
+    报告中的PE可能来自静态市盈率数据源，而历史序列是滚动市盈率口径，
+    因此分位按同口径的risk_point（update_risk_premium_history的返回值）计算。
+    """
+    if risk_point is None:
+        return risk_premium
+    try:
+        context = report_history.risk_premium_context(float(risk_point["risk_premium"]), years)
+    except Exception as e:
+        print(f"风险溢价历史分位计算出错: {e}")
+        return risk_premium
+    if context is None:
+        return risk_premium
+    bands = context["bands"]
+    print(f"📉 风险溢价近{years}年分位（滚动PE口径 {risk_point['risk_premium']:.3f}%，"
+          f"{pd.Timestamp(risk_point['date']):%Y-%m-%d}）: {context['percentile']:.1f}% "
+          f"(P10={bands[10]:.3f}%, P50={bands[50]:.3f}%, P90={bands[90]:.3f}%, {context['count']}天)")
+    return f"{risk_premium} (近{years}年{context['percentile']:.0f}%分位)"
+
 def get_access_token():
-    """获取微信access token"""
+    """获取微信access token（优先使用本地缓存的有效token）"""
     try:
         # 检查必需参数
         if not appID or not appSecret:
             print(f"❌ 微信配置缺失: APP_ID={bool(appID)}, APP_SECRET={bool(appSecret)}")
             return None
-            
-        url = 'https://api.weixin.qq.com/cgi-bin/token?grant_type=client_credential&appid={}&secret={}' \
-            .format(appID.strip(), appSecret.strip())
-        print(f"🔑 正在获取access token...")
-        print(f"🔍 请求URL: {url[:80]}...")
-        
-        response = requests.get(url, timeout=REQUEST_TIMEOUT)
-        response.raise_for_status()
-        data = response.json()
-        print(f"📋 Access token响应: {data}")
-        
-        if 'access_token' in data:
-            print(f"✅ Access token获取成功")
-            return data.get('access_token')
-        else:
-            print(f"❌ Access token获取失败: {data}")
-            # 常见错误码说明
-            error_codes = {
-                40013: "AppID无效，请检查APP_ID",
-                40125: "AppSecret无效，请检查APP_SECRET"
-            }
-            errcode = data.get('errcode')
-            if errcode in error_codes:
-                print(f"💡 解决建议: {error_codes[errcode]}")
-            return None
+        
+        return wechat_client.get_token_manager(appID, appSecret).get_token()
     except Exception as e:
         print(f"🚨 获取access token异常: {e}")
         print(f"🔍 详细错误: {traceback.format_exc()}")
         return None
 
+def _split_openids(ids):
+    """OpenID列表或逗号分隔的字符串，去掉空白和空项"""
+    if isinstance(ids, str):
+        ids = ids.split(",")
+    return [str(oid).strip() for oid in ids if str(oid).strip()]
+
+def get_recipient_groups():
+    """接收者分组 {template_id: [openid, ...]}
+
+    默认使用 TEMPLATE_ID 和 OPEN_ID（多个OpenID用逗号分隔）；
+    设置 WECHAT_RECIPIENT_GROUPS 时按其JSON配置为不同接收者组使用不同模板，
+    如 {"模板ID1": ["openid1", "openid2"], "模板ID2": "openid3,openid4"}。
+    两种配置按同样的规则去掉空白和空项，没有接收者的组被忽略；JSON格式错误时抛出ValueError。
+    """
+    groups_json = os.environ.get("WECHAT_RECIPIENT_GROUPS", "").strip()
+    if groups_json:
+        try:
+            groups = {str(tid).strip(): _split_openids(ids) for tid, ids in json.loads(groups_json).items()}
+        except (AttributeError, TypeError) as e:
+            raise ValueError(f"应为 {{模板ID: OpenID列表或逗号分隔字符串}}: {e}")
+    elif openId and template_id:
+        groups = {template_id.strip(): _split_openids(openId)}
+    else:
+        return {}
+    return {tid: openids for tid, openids in groups.items() if tid and openids}
+
 def send_comprehensive_report(access_token, weather_data, stock_data, bond_data, us_data, exchange_rate, crypto_data, risk_premium):
-    """发送综合报告"""
+    """发送综合报告（同一份数据限速并发发送给所有接收者），返回每个接收者的发送结果"""
     today = datetime.now().strftime("%Y年%m月%d日")
     
     # 检查必需参数
-    if not openId or not template_id:
+    try:
+        recipient_groups = get_recipient_groups()
+    except ValueError as e:
+        print(f"❌ WECHAT_RECIPIENT_GROUPS 格式错误: {e}")
+        return {}
+    if not recipient_groups:
         print(f"❌ 微信推送配置缺失: OPEN_ID={bool(openId)}, TEMPLATE_ID={bool(template_id)}")
-        return
+        return {}
     
     # 详细打印要发送的数据
     print(f"📤 准备发送数据:")
     print(f"   日期: {today}")
     print(f"   天气: {weather_data[2]} {weather_data[1]}")
-    print(f"   openId: {openId[:10] if len(openId) > 10 else openId}...") 
-    print(f"   template_id: {template_id}")
+    for tid, openids in recipient_groups.items():
+        print(f"   template_id: {tid}, 接收者: {len(openids)}个")
     print(f"   access_token: {access_token[:20] if len(access_token) > 20 else access_token}...")
     
-    body = {
-        "touser": openId.strip(),
-        "template_id": template_id.strip(),
-        "url": "https://weixin.qq.com",
-        "data": {
-            "date": {"value": today},
-            "weather": {"value": f"{weather_data[2]} {weather_data[1]}"},
-            "sh_index": {"value": stock_data.get('sh_index', '获取失败')},
-            "hs300": {"value": stock_data.get('hs300_index', '获取失败')},
-            "bond_10y": {"value": bond_data},
-            "risk_premium": {"value": risk_premium},
-            "usd_cny": {"value": exchange_rate},
-            "dji": {"value": us_data.get('dji', '获取失败')},
-            "nasdaq": {"value": us_data.get('nasdaq', '获取失败')},
-            "sp500": {"value": us_data.get('sp500', '获取失败')},
-            "bitcoin": {"value": crypto_data.get('bitcoin', '获取失败')},
-            "ethereum": {"value": crypto_data.get('ethereum', '获取失败')}
-        }
+    data = {
+        "date": {"value": today},
+        "weather": {"value": f"{weather_data[2]} {weather_data[1]}"},
+        "sh_index": {"value": stock_data.get('sh_index', '获取失败')},
+        "hs300": {"value": stock_data.get('hs300_index', '获取失败')},
+        "bond_10y": {"value": bond_data},
+        "risk_premium": {"value": risk_premium},
+        "usd_cny": {"value": exchange_rate},
+        "dji": {"value": us_data.get('dji', '获取失败')},
+        "nasdaq": {"value": us_data.get('nasdaq', '获取失败')},
+        "sp500": {"value": us_data.get('sp500', '获取失败')},
+        "bitcoin": {"value": crypto_data.get('bitcoin', '获取失败')},
+        "ethereum": {"value": crypto_data.get('ethereum', '获取失败')}
     }
     
-    print(f"📜 请求体JSON: {json.dumps(body, ensure_ascii=False, indent=2)}")
+    print(f"📜 模板数据JSON: {json.dumps(data, ensure_ascii=False, indent=2)}")
+    
+    error_codes = {
+        40003: "OpenID无效，请重新关注测试号",
+        40037: "模板ID无效，请检查template_id",
+        42001: "Access token过期，请重试",
+        47003: "模板参数错误，请检查模板字段",
+        40013: "AppID无效",
+        41001: "Access token缺失或无效",
+        43004: "需要接收者关注"
+    }
     
     try:
-        url = 'https://api.weixin.qq.com/cgi-bin/message/template/send?access_token={}'.format(access_token)
         print(f"📨 正在发送消息到微信API...")
-        print(f"🔍 请求URL: {url[:100]}...")
-        
-        # 设置正确的Content-Type
-        headers = {
-            'Content-Type': 'application/json; charset=utf-8'
-        }
-        
-        response = requests.post(
-            url, 
-            data=json.dumps(body, ensure_ascii=False).encode('utf-8'),
-            headers=headers,
-            timeout=REQUEST_TIMEOUT
-        )
-        
-        print(f"📊 HTTP状态码: {response.status_code}")
-        response.raise_for_status()
-        
-        result = response.json()
-        print(f"📋 发送响应: {result}")
-        
-        if result.get('errcode') == 0:
-            print(f"✅ 消息发送成功! 消息ID: {result.get('msgid', 'N/A')}")
-        else:
-            print(f"❌ 消息发送失败!")
-            print(f"   错误码: {result.get('errcode')}")
-            print(f"   错误信息: {result.get('errmsg')}")
-            
-            error_codes = {
-                40003: "OpenID无效，请重新关注测试号",
-                40037: "模板ID无效，请检查template_id",
-                42001: "Access token过期，请重试",
-                47003: "模板参数错误，请检查模板字段",
-                40013: "AppID无效",
-                41001: "Access token缺失或无效",
-                43004: "需要接收者关注"
-            }
-            
-            if result.get('errcode') in error_codes:
-                print(f"💡 解决建议: {error_codes[result.get('errcode')]}")
-                
-    except requests.exceptions.RequestException as e:
-        print(f"🚨 HTTP请求异常: {e}")
-        print(f"🔍 详细错误: {traceback.format_exc()}")
+        results = wechat_client.send_template_fanout(
+            wechat_client.get_token_manager(appID, appSecret), recipient_groups, data)
     except Exception as e:
         print(f"🚨 发送消息异常: {e}")
         print(f"🔍 详细错误: {traceback.format_exc()}")
+        return {}
+    
+    for (tid, openid), result in results.items():
+        masked = openid[:10] if len(openid) > 10 else openid
+        if result["ok"]:
+            print(f"✅ {masked}... 消息发送成功!")
+        else:
+            print(f"❌ {masked}... 消息发送失败! 错误码: {result['errcode']}, "
+                  f"错误信息: {result['errmsg']}, 尝试{result['attempts']}次")
+            if result["errcode"] in error_codes:
+                print(f"💡 解决建议: {error_codes[result['errcode']]}")
+    return results
+
+# 数据获取失败或超时时使用的默认值
+REPORT_DEFAULTS = {
+    "weather": (WEATHER_CITIES[0], "无法获取", "无法获取", "无法获取"),
+    "sh_index": '获取失败',
+    "hs300_index": '获取失败',
+    "hs300_pe": FALLBACK_HS300_PE,
+    "bond": FALLBACK_BOND_YIELD,
+    "us": {'dji': '获取失败', 'nasdaq': '获取失败', 'sp500': '获取失败'},
+    "exchange": "7.2500",
+    "crypto": {'bitcoin': '获取失败', 'ethereum': '获取失败'},
+}
+
+async def collect_report_data(timeout=None):
+    """在一个事件循环上并发发起所有上游请求（每个指数、每个备用数据源各自独立）
+
+    返回以REPORT_DEFAULTS的键为键的结果字典，超时或失败的项使用默认值。
+    """
+    engine = async_engine.AsyncEngine()
+    
+    async def index_quote(symbol):
+        return format_index_quote(await engine.run_blocking("akshare", get_index_tail, symbol))
+    
+    async def race_chain(chain, data_sources, is_valid=bool):
+        source_name, value = await engine.race(
+            data_sources, is_valid=is_valid, mode=SOURCE_FETCH_MODE, hedge_delay=SOURCE_HEDGE_DELAY,
+            chain=chain)
+        if value is not None:
+            print(f"✅ 成功从{source_name}获取: {value}")
+        return value
+    
+    async def yahoo_view(get_func):
+        # get_func带超时装饰器，会在线程中等待结果，因此同样放到线程池执行，不阻塞事件循环
+        await engine.run_blocking("yahoo", get_yahoo_quotes)
+        return await engine.run_blocking("yahoo", get_func)
+    
+    pe_task = asyncio.ensure_future(race_chain("hs300_pe", pe_data_sources(), is_valid=is_valid_pe))
+    bond_task = asyncio.ensure_future(race_chain("bond", bond_data_sources()))
+    
+    async def risk_history():
+        # 等PE和国债收益率链路结束后再执行：复用其已缓存的理杏仁/中美国债全量表，
+        # 也不与其争抢akshare主机的并发名额（使用单独的限流键）
+        await asyncio.wait([pe_task, bond_task])
+        return await engine.run_blocking("risk_history", update_risk_premium_history)
+    
+    results = await async_engine.gather_partial({
+        "weather_table": engine.run_blocking(hefeng_host, get_weather_for_cities, WEATHER_CITIES),
+        "sh_index": index_quote('sh000001'),
+        "hs300_index": index_quote('sh000300'),
+        "hs300_pe": pe_task,
+        "bond": bond_task,
+        "us": yahoo_view(get_us_stock_data),
+        "exchange": yahoo_view(get_exchange_rate),
+        "crypto": yahoo_view(get_crypto_data),
+        "risk_history": risk_history(),
+    }, timeout=timeout)
+    
+    # 模板中的天气字段使用第一个城市
+    weather_table = results.get("weather_table") or {}
+    if WEATHER_CITIES[0] in weather_table:
+        results["weather"] = weather_table[WEATHER_CITIES[0]]
+    
+    collected = {name: default if results.get(name) is None else results[name]
+                 for name, default in REPORT_DEFAULTS.items()}
+    collected["weather_table"] = weather_table
+    collected["fallbacks"] = [name for name in REPORT_DEFAULTS if results.get(name) is None]
+    collected["risk_point"] = results.get("risk_history")
+    return collected
+
+# 数据收集阶段占整份报告时间预算的比例，其余留给获取token和发送
+COLLECT_BUDGET_SHARE = 0.75
 
 def main():
     """主函数 - 并发优化版（集成Tushare）"""
     start_time = time.time()
     print("🚀 开始获取综合报告数据（集成Tushare版本）...")
     
-    # 使用线程池并发获取数据
-    with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
-        # 提交所有任务
-        weather_future = executor.submit(get_weather, "惠州")
-        stock_future = executor.submit(get_china_stock_data)
-        bond_future = executor.submit(get_bond_data)
-        us_future = executor.submit(get_us_stock_data)
-        exchange_future = executor.submit(get_exchange_rate)
-        crypto_future = executor.submit(get_crypto_data)
-        
-        # 收集结果并处理异常
-        try:
-            weather_data = weather_future.result()
-        except Exception as e:
-            print(f"❌ 天气数据获取失败: {e}")
-            weather_data = ("惠州", "无法获取", "无法获取", "无法获取")
-            
-        stock_data = stock_future.result()
-        bond_data = bond_future.result()
-        us_data = us_future.result()
-        exchange_rate = exchange_future.result()
-        crypto_data = crypto_future.result()
-    
-    # 计算风险溢价
-    risk_premium = calculate_risk_premium(stock_data.get('hs300_pe', 13.5), bond_data)
-    
-    print("📊 数据获取完成，发送报告...")
-    
-    # 获取access token并发送报告
-    access_token = get_access_token()
-    if access_token:
-        send_comprehensive_report(access_token, weather_data, stock_data, bond_data, 
-                                us_data, exchange_rate, crypto_data, risk_premium)
-        print("✅ 综合报告发送完成!")
-    else:
-        print("❌ 获取access token失败!")
+    report_deadline = deadline.Deadline(deadline.REPORT_DEADLINE_SECONDS, name="综合报告")
+    with deadline.scope(report_deadline):
+        collect_deadline = report_deadline.child(share=COLLECT_BUDGET_SHARE, name="数据收集")
+        
+        # 所有上游请求在一个事件循环上并发执行，截止时间到达后未返回的数据源直接使用默认值
+        with deadline.scope(collect_deadline):
+            results = asyncio.run(collect_report_data(timeout=collect_deadline.remaining()))
+        collect_deadline.cancel()
+        
+        weather_data = results["weather"]
+        stock_data = {key: results[key] for key in ("sh_index", "hs300_index", "hs300_pe")}
+        bond_data = results["bond"]
+        us_data = results["us"]
+        exchange_rate = results["exchange"]
+        crypto_data = results["crypto"]
+        
+        # 计算风险溢价
+        risk_premium = calculate_risk_premium(stock_data.get('hs300_pe', FALLBACK_HS300_PE), bond_data)
+        # PE或国债收益率使用了默认值时不附历史分位
+        if {"hs300_pe", "bond"} & set(results["fallbacks"]):
+            risk_premium_text = risk_premium
+        else:
+            risk_premium_text = format_risk_premium(risk_premium, results["risk_point"])
+        
+        print("📊 数据获取完成，发送报告...")
+        
+        # 获取access token并发送报告
+        access_token = get_access_token()
+        if access_token:
+            send_comprehensive_report(access_token, weather_data, stock_data, bond_data, 
+                                    us_data, exchange_rate, crypto_data, risk_premium_text)
+            print("✅ 综合报告发送完成!")
+        else:
+            print("❌ 获取access token失败!")
     
+    http_client.print_stats()
     total_time = time.time() - start_time
+    metrics.record("report", "main", total_time, start=start_time)
+    metrics.export()
+    report_history.record_run(metrics.RUN_ID, start_time, total_time, results, risk_premium,
+                              metrics.spans(), fallbacks=results["fallbacks"], risk_point=results["risk_point"])
     print(f"⏱️ 总耗时: {total_time:.2f}秒")
 
+_module_start_elapsed = time.perf_counter() - _module_start
+
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    if "--import-profile" in sys.argv:
+        # 打印启动耗时和各数据源依赖的导入耗时，用于检查启动性能退化
+        print(f"🚀 comprehensive_report 启动耗时: {(_module_start_elapsed) * 1000:.1f} ms")
+        lazy_import.profile_imports(["numpy", "pandas", "requests", "akshare", "yfinance", "tushare", "bs4", "lxml"])
+    else:
+        main()
\ No newline at end of file
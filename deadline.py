@@ -0,0 +1,143 @@
+# 截止时间管理 - 整份报告的时间预算、按阶段拆分、协作式取消
+import contextvars
+import os
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+REPORT_DEADLINE_SECONDS = float(os.environ.get("REPORT_DEADLINE_SECONDS", "240"))
+
+_current = contextvars.ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """超过截止时间或已被取消"""
+
+
+class Deadline:
+    """截止时间，子截止时间不会晚于父级，父级取消时子级随之取消"""
+
+    def __init__(self, seconds=None, parent=None, name=""):
+        self.name = name
+        self.parent = parent
+        expires_at = float("inf") if seconds is None else time.time() + seconds
+        if parent is not None:
+            expires_at = min(expires_at, parent.expires_at)
+        self.expires_at = expires_at
+        self._cancelled = threading.Event()
+
+    def child(self, seconds=None, share=None, name=""):
+        """拆分预算：seconds为固定秒数，share为剩余时间的比例"""
+        if share is not None:
+            remaining = self.remaining()
+            seconds = remaining * share if seconds is None else min(seconds, remaining * share)
+        return Deadline(seconds, parent=self, name=name)
+
+    def remaining(self):
+        if self.cancelled:
+            return 0.0
+        return max(0.0, self.expires_at - time.time())
+
+    def cancel(self):
+        self._cancelled.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set() or (self.parent is not None and self.parent.cancelled)
+
+    def expired(self):
+        return self.cancelled or time.time() >= self.expires_at
+
+    def check(self):
+        if self.expired():
+            raise DeadlineExceeded(f"{self.name or '任务'}已超时或被取消")
+
+
+class scope:
+    """在with块内把deadline设为当前截止时间"""
+
+    def __init__(self, deadline):
+        self.deadline = deadline
+        self._token = None
+
+    def __enter__(self):
+        self._token = _current.set(self.deadline)
+        return self.deadline
+
+    def __exit__(self, *exc):
+        _current.reset(self._token)
+
+
+def current():
+    return _current.get()
+
+
+def remaining(default=None):
+    deadline = current()
+    if deadline is None or deadline.expires_at == float("inf"):
+        return default
+    return deadline.remaining()
+
+
+def check():
+    """协作式取消检查点：当前任务超时或被取消时抛出DeadlineExceeded"""
+    deadline = current()
+    if deadline is not None:
+        deadline.check()
+
+
+def clamp_timeout(timeout):
+    """把请求超时限制在当前截止时间之内"""
+    check()
+    left = remaining()
+    if left is None:
+        return timeout
+    if timeout is None:
+        return left
+    if isinstance(timeout, tuple):
+        return tuple(min(t, left) if t is not None else left for t in timeout)
+    return min(timeout, left)
+
+
+def spawn(func, *args, deadline=None, **kwargs):
+    """在守护线程中执行func并返回Future
+
+    线程继承调用方的上下文（包括当前截止时间），deadline不为空时在其作用域内执行。
+    使用守护线程是为了让卡死的第三方调用不会阻止进程退出。
+    """
+    future = Future()
+    context = contextvars.copy_context()
+
+    def call():
+        if deadline is not None:
+            with scope(deadline):
+                return func(*args, **kwargs)
+        return func(*args, **kwargs)
+
+    def target():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(context.run(call))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=target, daemon=True, name=f"deadline-{getattr(func, '__name__', 'task')}").start()
+    return future
+
+
+def run_with_deadline(func, seconds, *args, **kwargs):
+    """执行func，最多等待seconds秒（不超过上层截止时间）
+
+    超时后取消该任务的截止时间（任务内部的检查点会尽快退出）并抛出DeadlineExceeded，
+    不再等待其结束。
+    """
+    deadline = Deadline(seconds, parent=current(), name=getattr(func, "__name__", ""))
+    future = spawn(func, *args, deadline=deadline, **kwargs)
+    try:
+        return future.result(timeout=deadline.remaining())
+    except FutureTimeoutError:
+        if future.done():
+            raise
+        deadline.cancel()
+        raise DeadlineExceeded(f"{deadline.name}未在截止时间内完成（上限{seconds}秒）")
@@ -0,0 +1,185 @@
+# 共享HTTP客户端 - 按主机复用连接池（keep-alive、gzip），带抖动的有限重试，按主机限制并发
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import deadline
+import metrics
+import replay
+
+DEFAULT_TIMEOUT = 10
+POOL_CONNECTIONS = int(os.environ.get("HTTP_POOL_CONNECTIONS", "20"))  # 缓存连接池的主机数
+POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", "10"))          # 每个主机保持的连接数
+MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "2"))
+BACKOFF_FACTOR = float(os.environ.get("HTTP_BACKOFF_FACTOR", "0.5"))
+BACKOFF_JITTER = float(os.environ.get("HTTP_BACKOFF_JITTER", "0.5"))
+HOST_CONCURRENCY = int(os.environ.get("HTTP_HOST_CONCURRENCY", "4"))   # 每个主机同时进行的请求数
+
+DEFAULT_HEADERS = {
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive",
+}
+
+_session = None
+_session_lock = threading.Lock()
+_host_semaphores = {}
+_host_stats = {}
+_stats_lock = threading.Lock()
+
+
+def _build_retry():
+    """只对幂等请求在连接错误和429/5xx时重试，退避时间带随机抖动"""
+    options = dict(
+        total=MAX_RETRIES,
+        backoff_factor=BACKOFF_FACTOR,
+        status_forcelist=(429, 500, 502, 503, 504),
+        raise_on_status=False,
+        respect_retry_after_header=True,
+    )
+    try:
+        return Retry(backoff_jitter=BACKOFF_JITTER, **options)
+    except TypeError:
+        # urllib3 < 2.0 不支持 backoff_jitter
+        return Retry(**options)
+
+
+def build_adapter():
+    """创建连接池适配器；更换传输层（如HTTP/2）时只需替换这里挂载的适配器"""
+    return HTTPAdapter(pool_connections=POOL_CONNECTIONS, pool_maxsize=POOL_MAXSIZE,
+                       max_retries=_build_retry())
+
+
+def get_session():
+    """获取进程内共享的Session（所有调用方复用同一组连接池）"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            session.headers.update(DEFAULT_HEADERS)
+            adapter = build_adapter()
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+
+def _host_semaphore(host):
+    with _stats_lock:
+        if host not in _host_semaphores:
+            _host_semaphores[host] = threading.BoundedSemaphore(HOST_CONCURRENCY)
+        return _host_semaphores[host]
+
+
+def request(method, url, **kwargs):
+    """发送HTTP请求，用法同 requests.request，默认超时DEFAULT_TIMEOUT秒"""
+    # 超时不超过当前任务的截止时间；任务已超时或被取消时直接放弃请求
+    kwargs["timeout"] = deadline.clamp_timeout(kwargs.get("timeout", DEFAULT_TIMEOUT))
+    host = urlsplit(url).netloc
+    request_url, request_kwargs = url, kwargs
+    if replay.MODE == "replay":
+        request_url, request_kwargs = replay.route(method, url, kwargs)
+    session = get_session()
+    start_time = time.time()
+    with _host_semaphore(host):
+        failed = False
+        try:
+            response = session.request(method, request_url, **request_kwargs)
+        except Exception as e:
+            failed = True  # DNS失败、超时、连接重置等没有响应的请求也计入失败次数
+            metrics.record("http", host, time.time() - start_time, status="error", start=start_time,
+                           method=method, error=str(e)[:200])
+            raise
+        finally:
+            elapsed = time.time() - start_time
+            with _stats_lock:
+                stat = _host_stats.setdefault(host, {"requests": 0, "errors": 0, "bytes": 0, "seconds": 0.0})
+                stat["requests"] += 1
+                stat["seconds"] += elapsed
+                if failed:
+                    stat["errors"] += 1
+    size = len(response.content or b"")
+    if replay.MODE == "record":
+        replay.record_http(method, url, kwargs.get("params"), response, elapsed)
+    with _stats_lock:
+        stat["bytes"] += size
+        if response.status_code >= 400:
+            stat["errors"] += 1
+    metrics.record("http", host, elapsed, status="ok" if response.status_code < 400 else "error",
+                   start=start_time, method=method, http_status=response.status_code, bytes=size)
+    return response
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, data=None, json=None, **kwargs):
+    return request("POST", url, data=data, json=json, **kwargs)
+
+
+def stats():
+    """按主机返回请求统计和连接复用情况
+
+    new_connections 为实际建立的TCP/TLS连接数，reused 为复用已有连接的请求数。
+    """
+    pool_counts = {}
+    session = _session
+    if session is not None:
+        for adapter in {id(a): a for a in session.adapters.values()}.values():
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                host = pool.host if pool.port in (None, 80, 443) else f"{pool.host}:{pool.port}"
+                counts = pool_counts.setdefault(host, [0, 0])
+                counts[0] += pool.num_connections
+                counts[1] += pool.num_requests
+
+    result = {}
+    with _stats_lock:
+        for host, stat in _host_stats.items():
+            connections, pool_requests = pool_counts.get(host, (0, 0))
+            result[host] = dict(stat, new_connections=connections,
+                                reused=max(0, pool_requests - connections))
+    return result
+
+
+def print_stats():
+    host_stats = stats()
+    if not host_stats:
+        return
+    print("🔌 HTTP连接统计:")
+    for host, stat in sorted(host_stats.items()):
+        print(f"   {host}: 请求{stat['requests']}次, 新建连接{stat['new_connections']}个, "
+              f"复用{stat['reused']}次, 失败{stat['errors']}次, "
+              f"{stat['bytes'] / 1024:.1f}KB, 累计{stat['seconds']:.2f}秒")
+
+
+class RateLimiter:
+    """令牌桶限流器（线程安全），rate为每秒允许的请求数，burst为允许的突发数"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst if burst is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """阻塞直到取得一个令牌"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
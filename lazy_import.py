@@ -0,0 +1,75 @@
+# 延迟导入 - 重量级依赖在第一次使用时才导入，并记录每个模块的导入耗时
+import importlib
+import sys
+import threading
+import time
+import types
+
+# 模块名 -> 首次导入耗时（秒）
+IMPORT_TIMES = {}
+
+_import_lock = threading.RLock()
+
+
+def timed_import(name):
+    """导入模块并记录耗时（已导入的模块直接返回）"""
+    module = sys.modules.get(name)
+    if module is not None and not isinstance(module, LazyModule):
+        return module
+    with _import_lock:
+        start_time = time.perf_counter()
+        module = importlib.import_module(name)
+        IMPORT_TIMES.setdefault(name, time.perf_counter() - start_time)
+    return module
+
+
+class LazyModule(types.ModuleType):
+    """模块代理：访问任意属性时才真正导入模块"""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.__dict__["_lazy_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_lazy_module"]
+        if module is None:
+            module = timed_import(self.__name__)
+            self.__dict__["_lazy_module"] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    @property
+    def loaded(self):
+        return self.__dict__["_lazy_module"] is not None
+
+
+def lazy(name):
+    return LazyModule(name)
+
+
+def profile_imports(names):
+    """依次导入names中的模块并打印每个模块的导入耗时
+
+    按顺序导入，后面的模块不再计入前面已导入的共同依赖（如pandas不含numpy）。
+    """
+    print("📦 模块导入耗时:")
+    total = 0.0
+    for name in names:
+        already_loaded = name in sys.modules and name not in IMPORT_TIMES
+        try:
+            timed_import(name)
+        except ImportError as e:
+            print(f"   {name:<12} 未安装 ({e})")
+            continue
+        if already_loaded:
+            print(f"   {name:<12} 已导入（启动时或随前面的模块）")
+            continue
+        elapsed = IMPORT_TIMES.get(name, 0.0)
+        total += elapsed
+        print(f"   {name:<12} {elapsed * 1000:8.1f} ms")
+    print(f"   {'合计':<12} {total * 1000:8.1f} ms")
@@ -1,15 +1,45 @@
 # 版权https://github.com/royalneverwin/beating-heart
 
-from tkinter import * # Python 实现GUI界面的包
+try:
+    from tkinter import * # Python 实现GUI界面的包
+except ImportError: # headless python without tk, only --export works
+    Tk = Canvas = PhotoImage = None
 from math import sin, cos, pi, log
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
 import random
+import struct
+import sys
 import time
+import zipfile
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import numpy as np # vectorized engine, falls back to pure python without numpy
+except ImportError:
+    np = None
 
 CANVAS_WIDTH = 640
 CANVAS_HEIGHT = 480
 CANVAS_CENTER_X = CANVAS_WIDTH / 2
 CANVAS_CENTER_Y = CANVAS_HEIGHT / 2
 IMAGE_ENLARGE = 11
+HEART_COLOR = (0xff, 0x71, 0x71) # '#ff7171'
+CURVE_POINTS = 2000 #*** can modify ***#
+EDGE_REPEAT = 3 #*** can modify ***#
+INSIDE_POINTS = 4000 #*** can modify ***#
+HALO_ENLARGE = 11.6
+
+# precomputed frames of seeded hearts are cached here (next to the script, or in the home dir for a packaged exe)
+FRAME_CACHE_DIR = os.environ.get('LOVE_HEART_CACHE') or (
+    os.path.join(os.path.expanduser('~'), '.cache', 'love_heart') if getattr(sys, 'frozen', False)
+    else os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'love_heart'))
+FRAME_CACHE_VERSION = 1 # bump when the generation code changes
+DEFAULT_SEED = 0
 
 
 def scatter_inside(x, y, beta=0.15): # log scatter & scatter inside
@@ -42,23 +72,132 @@ def shrink(x, y, ratio):
     return x - dx, y - dy
 
 
+# array versions of the functions above: x, y, t are numpy arrays, one call per layer
+def heart_function_np(t, enlarge_ratio: float = IMAGE_ENLARGE):
+    x = 16 * np.sin(t) ** 3
+    y = -(13 * np.cos(t) - 5 * np.cos(2*t) - 2 * np.cos(3*t) - np.cos(4*t))
+    x = x * enlarge_ratio + CANVAS_CENTER_X
+    y = y * enlarge_ratio + CANVAS_CENTER_Y
+    return np.trunc(x), np.trunc(y) # same as int() in heart_function
+
+
+def shrink_np(x, y, ratio):
+    dx, dy = x - CANVAS_CENTER_X, y - CANVAS_CENTER_Y
+    sk_range = -1 / (dx ** 2 + dy ** 2)
+    return x - ratio * sk_range * dx, y - ratio * sk_range * dy
+
+
+def scatter_inside_np(x, y, rng, beta=0.15):
+    # 1 - random() keeps log() away from 0, same distribution as scatter_inside
+    ratiox = - beta * np.log(1 - rng.random(len(x)))
+    ratioy = - beta * np.log(1 - rng.random(len(y)))
+    return x - ratiox * (x - CANVAS_CENTER_X), y - ratioy * (y - CANVAS_CENTER_Y)
+
+
+def unique_points(x, y):
+    # set() of integer (x, y) pairs for arrays, keeps first-seen order
+    keys = (x.astype(np.int64) << 32) + y.astype(np.int64)
+    _, idx = np.unique(keys, return_index=True)
+    idx.sort()
+    return x[idx], y[idx]
+
+
+class FrameStore:
+    # all frames in one padded (frames, capacity, 3) int16 array of x, y, size plus per-frame point counts,
+    # a few bytes per point instead of a tuple of floats; with path the array is a memory-mapped .npy file
+    def __init__(self, frames, capacity, path=None):
+        shape = (frames, capacity, 3)
+        if path:
+            self.data = np.lib.format.open_memmap(path, mode='w+', dtype=np.int16, shape=shape)
+        else:
+            self.data = np.zeros(shape, dtype=np.int16)
+        self.counts = np.zeros(frames, dtype=np.int32)
+
+    def __len__(self):
+        return len(self.counts)
+
+    def __getitem__(self, frame): # (n, 3) view of one frame
+        return self.data[frame, :self.counts[frame]]
+
+    def __setitem__(self, frame, points):
+        n = len(points)
+        self.data[frame, :n] = np.floor(points) # pixel coordinates, same cell rasterize/tkinter draw
+        self.counts[frame] = n
+
+    @property
+    def nbytes(self):
+        return self.data.nbytes + self.counts.nbytes
+
+    def save(self, path): # atomic write, a crashed launch never leaves a half written cache
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f'{path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, data=self.data, counts=self.counts)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path): # None when missing or unreadable, the caller regenerates
+        try:
+            with np.load(path) as f:
+                data, counts = f['data'], f['counts']
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            return None
+        store = cls.__new__(cls)
+        store.data, store.counts = data, counts
+        return store
+
+
+def frame_cache_path(frame, seed, cache_dir=FRAME_CACHE_DIR):
+    # one file per parameter set, any change to them gives a new key and a fresh precompute
+    params = {
+        'version': FRAME_CACHE_VERSION, 'frames': frame, 'seed': seed,
+        'curve_points': CURVE_POINTS, 'edge_repeat': EDGE_REPEAT, 'inside_points': INSIDE_POINTS,
+        'canvas': [CANVAS_WIDTH, CANVAS_HEIGHT], 'enlarge': IMAGE_ENLARGE, 'halo_enlarge': HALO_ENLARGE,
+    }
+    key = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:16]
+    return os.path.join(cache_dir, f'heart-{key}.npz')
+
+
 class Heart:
-    def __init__(self, frame):
+    # engine 'numpy' generates each layer as arrays (points are (n, 2) arrays, frames live in a FrameStore),
+    # 'python' is the original per-point version (points are sets of tuples, each frame a list of tuples)
+    # with a seed and cache_dir the numpy engine loads its frames from the cache file, or precomputes and saves them
+    def __init__(self, frame, engine=None, seed=None, precompute=True, mmap_path=None, cache_dir=None):
+        self.engine = engine or ('numpy' if np is not None else 'python')
+        self.random_halo = 1000 # for halo
+        cache_path = None
+        if self.engine == 'numpy' and precompute and seed is not None and cache_dir:
+            cache_path = frame_cache_path(frame, seed, cache_dir)
+            store = FrameStore.load(cache_path)
+            if store is not None and len(store) == frame:
+                self.frame = frame
+                self.all_points = store
+                self.points = self.edge_points = self.inside_points = None # only needed to calc frames
+                return
+        if self.engine == 'numpy':
+            self.rng = np.random.default_rng(seed)
+        elif seed is not None:
+            random.seed(seed)
         self.points = set()
         self.edge_points = set()
         self.inside_points = set()
         self.all_points = {}
-        self.build(2000) #*** can modify ***#
+        self.build(CURVE_POINTS)
         self.frame = frame
-        for f in range(frame):  # pre calculate
+        if self.engine == 'numpy': # no store without precompute: export workers only return frames
+            self.all_points = FrameStore(frame, self.frame_capacity(), mmap_path) if precompute else None
+        for f in range(frame if precompute else 0):  # pre calculate
             self.calc(f)
-
-        # for halo
-        self.random_halo = 1000
-
+        if cache_path:
+            try:
+                self.all_points.save(cache_path)
+            except OSError:
+                pass # no cache this time, next launch precomputes again
 
 
     def build(self, number):
+        if self.engine == 'numpy':
+            return self.build_np(number)
         # randomly find 'number' points on the heart curve
         for _ in range(number):
             t = random.uniform(0, 2 * pi) # t = angle
@@ -68,18 +207,44 @@ class Heart:
 
         # randomly find points on the edge
         for px, py in self.points:
-            for _ in range(3): #*** can modify ***#
+            for _ in range(EDGE_REPEAT):
                 x, y = scatter_inside(px, py, 0.05) #*** can modify ***#
                 self.edge_points.add((x, y))
 
         # randomly find points inside the heart
         pt_ls = list(self.points)
-        for _ in range(4000): #*** can modify ***#
+        for _ in range(INSIDE_POINTS):
             x, y = random.choice(pt_ls) # choice need idx, and set has no idx, only list has
             x, y = scatter_inside(x, y) #*** can modify ***#
             self.inside_points.add((x, y))
 
 
+    def build_np(self, number, edge_repeat=EDGE_REPEAT, inside_number=INSIDE_POINTS):
+        rng = self.rng
+        # on the curve (deduplicated like the set in build)
+        x, y = heart_function_np(rng.uniform(0, 2 * pi, number))
+        x, y = shrink_np(x, y, -1000)
+        x, y = unique_points(np.trunc(x), np.trunc(y))
+        self.points = np.stack([x, y], axis=1).astype(np.int16) # integer pixels like the set in build
+
+        # on the edge: edge_repeat scattered copies of every curve point
+        ex, ey = scatter_inside_np(np.repeat(x, edge_repeat), np.repeat(y, edge_repeat), rng, 0.05)
+        self.edge_points = np.stack([ex, ey], axis=1).astype(np.float32)
+
+        # inside: scatter randomly chosen curve points
+        idx = rng.integers(0, len(x), inside_number)
+        ix, iy = scatter_inside_np(x[idx], y[idx], rng)
+        self.inside_points = np.stack([ix, iy], axis=1).astype(np.float32)
+
+
+    def halo_number(self): # same formula as calc, fixed per heart since it uses self.frame
+        return int(3000 + 4000 * abs(sin(self.frame / 10 * pi) ** 2))
+
+
+    def frame_capacity(self): # most points a frame can have: every halo point unique plus all layers
+        return self.halo_number() + len(self.points) + len(self.edge_points) + len(self.inside_points)
+
+
     def cal_position(self, x, y, ratio): # calculate the position of points when beating
         # attention: the closer to the center, the bigger beating range point has
         bt_range = 1 / ((x-CANVAS_CENTER_X) ** 2 + (y-CANVAS_CENTER_Y) ** 2)
@@ -88,7 +253,37 @@ class Heart:
         return x - dx, y - dy
 
 
+    def cal_position_np(self, xy, ratio, rng=None): # cal_position for an (n, 2) array
+        d = xy - (CANVAS_CENTER_X, CANVAS_CENTER_Y)
+        bt_range = 1 / (d ** 2).sum(axis=1, keepdims=True)
+        return xy - ratio * bt_range * d - (rng or self.rng).integers(-1, 2, xy.shape)
+
+
+    def calc_np(self, frame, rng=None):
+        # rng: per-frame generator, lets frames be computed independently (e.g. in worker processes)
+        rng = rng or self.rng
+        ratio = 800 * sin(frame / 10 * pi)
+
+        # for halo (same radius/number formula as calc)
+        halo_radius = int(4 + 6 * (1 + sin(self.frame / 10 * pi)))
+        x, y = heart_function_np(rng.uniform(0, 2 * pi, self.halo_number()), enlarge_ratio=HALO_ENLARGE)
+        x, y = shrink_np(*unique_points(x, y), halo_radius) # shrink maps equal points to equal points
+        halo = np.stack([x + rng.integers(-14, 15, len(x)), y + rng.integers(-14, 15, len(y)),
+                         rng.choice((1, 2, 2), len(x))], axis=1)
+
+        layers = [halo]
+        for pts, max_size in ((self.points, 3), (self.edge_points, 2), (self.inside_points, 2)):
+            xy = self.cal_position_np(pts, ratio, rng)
+            layers.append(np.column_stack([xy, rng.integers(1, max_size + 1, len(xy))]))
+        points = np.concatenate(layers)
+        if self.all_points is not None:
+            self.all_points[frame] = points
+        return points
+
+
     def calc(self, frame): # calculate points' position for different frame
+        if self.engine == 'numpy':
+            return self.calc_np(frame)
         ratio = 800 * sin(frame / 10 * pi) #*** can modify ***# this is 30 fps
         all_pts = []
 
@@ -98,7 +293,7 @@ class Heart:
         heart_halo_point = set()
         for _ in range(halo_number):
             t = random.uniform(0, 2 * pi)
-            x, y = heart_function(t, enlarge_ratio=11.6)
+            x, y = heart_function(t, enlarge_ratio=HALO_ENLARGE)
             x, y = shrink(x, y, halo_radius)
             if (x, y) not in heart_halo_point:
                 # 处理新的点
@@ -130,7 +325,10 @@ class Heart:
 
 
     def render(self, canvas, frame): # draw points
-        for x, y, size in self.all_points[frame % self.frame]: # set operation
+        points = self.all_points[frame % self.frame]
+        if self.engine == 'numpy':
+            points = points.tolist() # plain floats for tkinter
+        for x, y, size in points: # set operation
             canvas.create_rectangle(x, y, x+size, y+size, width=0, fill='#ff7171')
 
 
@@ -140,11 +338,164 @@ def draw(root: Tk, canvas: Canvas, heart: Heart, frame=0):
     root.after(30, draw, root, canvas, heart, frame+1)
 
 
+def rasterize_mask(points, width=CANVAS_WIDTH, height=CANVAS_HEIGHT, scale=1):
+    # (n, 3) array of x, y, size -> (height*scale, width*scale) bool mask,
+    # every point a size x size square like the rectangles in Heart.render
+    width, height = width * scale, height * scale
+    x = np.floor(points[:, 0] * scale).astype(np.int64)
+    y = np.floor(points[:, 1] * scale).astype(np.int64)
+    size = np.ceil(points[:, 2] * scale).astype(np.int64)
+    mask = np.zeros((height, width), dtype=bool)
+    max_size = int(size.max()) if len(size) else 0
+    for dy in range(max_size):
+        for dx in range(max_size):
+            sel = size > max(dx, dy)
+            px, py = x[sel] + dx, y[sel] + dy
+            inside = (px >= 0) & (px < width) & (py >= 0) & (py < height)
+            mask[py[inside], px[inside]] = True
+    return mask
+
+
+def rasterize(points, width=CANVAS_WIDTH, height=CANVAS_HEIGHT, color=HEART_COLOR, scale=1):
+    # (n, 3) array of x, y, size -> (height*scale, width*scale, 3) uint8 RGB image on black
+    mask = rasterize_mask(points, width, height, scale)
+    image = np.zeros(mask.shape + (3,), dtype=np.uint8)
+    image[mask] = color
+    return image
+
+
+def to_ppm(image):
+    # binary PPM (P6), which tkinter.PhotoImage reads without PIL
+    height, width = image.shape[:2]
+    return b'P6 %d %d 255\n' % (width, height) + image.tobytes()
+
+
+class RasterRenderer:
+    # every precomputed frame is rasterized once into its own PhotoImage;
+    # playback only swaps the image of a single canvas item
+    def __init__(self, canvas: Canvas, heart: Heart):
+        self.canvas = canvas
+        self.frames = [PhotoImage(data=to_ppm(rasterize(heart.all_points[f])), format='PPM')
+                       for f in range(heart.frame)]
+        self.item = canvas.create_image(0, 0, anchor=NW, image=self.frames[0])
+
+    def render(self, frame):
+        self.canvas.itemconfig(self.item, image=self.frames[frame % len(self.frames)])
+
+
+def draw_raster(root: Tk, renderer: RasterRenderer, frame=0):
+    renderer.render(frame)
+    root.after(30, draw_raster, root, renderer, frame+1)
+
+
+def write_png(path, image):
+    # minimal RGB PNG writer (zlib only, no PIL): filter type 0 on every row
+    height, width = image.shape[:2]
+    raw = np.hstack([np.zeros((height, 1), dtype=np.uint8), image.reshape(height, width * 3)]).tobytes()
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+    with open(path, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(raw, 6)))
+        f.write(chunk(b'IEND', b''))
+
+
+# export workers: the built heart is sent once per process, every frame uses its own seeded generator,
+# so the output does not depend on the number of workers
+_export_heart = None
+
+
+def _init_export_worker(heart):
+    global _export_heart
+    _export_heart = heart
+
+
+def _export_frame(args):
+    frame, seed, scale, png_path = args
+    points = _export_heart.calc_np(frame, rng=np.random.default_rng((seed, frame)))
+    mask = rasterize_mask(points, scale=scale)
+    if png_path:
+        image = np.zeros(mask.shape + (3,), dtype=np.uint8)
+        image[mask] = HEART_COLOR
+        write_png(png_path, image)
+        return None
+    return np.packbits(mask) # 1 bit per pixel back to the parent for the GIF
+
+
+def export_frames(output, frames=20, scale=1, seed=None, workers=None, duration=30):
+    """Render frames without a display: output is a directory (PNG sequence) or a .gif file.
+
+    Frame generation, rasterization and PNG encoding run in a process pool; GIF assembly needs Pillow.
+    """
+    if np is None:
+        raise RuntimeError('headless export needs numpy')
+    if seed is None:
+        seed = int(np.random.SeedSequence().entropy % (2 ** 32))
+    heart = Heart(frames, seed=seed, precompute=False)
+    heart.rng = None # workers use per-frame generators
+
+    as_gif = output.lower().endswith('.gif')
+    if as_gif:
+        try:
+            from PIL import Image # optional dependency, only for GIF
+        except ImportError:
+            raise RuntimeError('GIF export needs Pillow (pip install pillow), or export PNG frames to a directory')
+        tasks = [(f, seed, scale, None) for f in range(frames)]
+    else:
+        os.makedirs(output, exist_ok=True)
+        tasks = [(f, seed, scale, os.path.join(output, f'frame_{f:04d}.png')) for f in range(frames)]
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_export_worker, initargs=(heart,)) as pool:
+        results = list(pool.map(_export_frame, tasks, chunksize=max(1, frames // (4 * (workers or os.cpu_count() or 1)))))
+
+    if as_gif:
+        shape = (CANVAS_HEIGHT * scale, CANVAS_WIDTH * scale)
+        palette = [0, 0, 0, *HEART_COLOR]
+        images = []
+        for packed in results:
+            mask = np.unpackbits(packed, count=shape[0] * shape[1]).reshape(shape)
+            image = Image.fromarray(mask, mode='L').convert('P') # values 0/1 become palette indices
+            image.putpalette(palette)
+            images.append(image)
+        images[0].save(output, save_all=True, append_images=images[1:], duration=duration, loop=0)
+    return seed
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='beating heart (Tk window, or headless export with --export)')
+    parser.add_argument('--export', metavar='PATH', help='render without a display: directory for PNG frames or a .gif file')
+    parser.add_argument('--frames', type=int, default=20, help='number of frames')
+    parser.add_argument('--scale', type=int, default=1, help='integer resolution multiplier for export')
+    parser.add_argument('--seed', type=int, default=None,
+                        help=f'random seed for reproducible output (window default: {DEFAULT_SEED}, export default: random)')
+    parser.add_argument('--no-cache', action='store_true', help='do not load or save precomputed frames')
+    parser.add_argument('--workers', type=int, default=None, help='export processes (default: CPU count)')
+    parser.add_argument('--mmap', metavar='FILE', default=None, help='keep precomputed frames in a memory-mapped .npy file')
+    return parser.parse_args(argv)
+
+
 if __name__ == '__main__':
+    multiprocessing.freeze_support() # export workers of the pyinstaller exe must not re-run main
+    args = parse_args()
+    if args.export:
+        start = time.perf_counter()
+        try:
+            seed = export_frames(args.export, frames=args.frames, scale=args.scale, seed=args.seed, workers=args.workers)
+        except RuntimeError as e:
+            sys.exit(f'export failed: {e}')
+        print(f'exported {args.frames} frames to {args.export} (seed {seed}) in {time.perf_counter() - start:.2f}s')
+        sys.exit(0)
     root = Tk()
     root.title('漂亮宝贝一周年快乐')
     canvas = Canvas(root, bg='black', height=CANVAS_HEIGHT, width=CANVAS_WIDTH)
     canvas.pack()
-    heart = Heart(20)
-    draw(root, canvas, heart)
+    seed = args.seed if args.seed is not None or args.no_cache else DEFAULT_SEED
+    heart = Heart(args.frames, seed=seed, mmap_path=args.mmap, cache_dir=None if args.no_cache else FRAME_CACHE_DIR)
+    if heart.engine == 'numpy':
+        draw_raster(root, RasterRenderer(canvas, heart))
+    else:
+        draw(root, canvas, heart)
     root.mainloop()
\ No newline at end of file
@@ -0,0 +1,271 @@
+# 行情数据本地缓存 - SQLite持久化，按数据源设置TTL，超出容量按LRU淘汰
+import os
+import sys
+import pickle
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+import metrics
+import replay
+
+# 录制/回放时关闭缓存，保证每次都经过上游调用
+CACHE_ENABLED = os.environ.get("MARKET_CACHE", "1") != "0" and not replay.MODE
+CACHE_PATH = replay.state_path(os.environ.get(
+    "MARKET_CACHE_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "market_cache.sqlite")))
+CACHE_MAX_BYTES = int(float(os.environ.get("MARKET_CACHE_MAX_MB", "64")) * 1024 * 1024)
+
+# 各数据源默认TTL（秒），可通过 MARKET_CACHE_TTL="akshare=3600,yahoo=300" 覆盖
+DEFAULT_TTLS = {
+    "akshare": 6 * 3600,   # 日线/估值数据每个交易日最多更新一次
+    "tushare": 6 * 3600,
+    "yahoo": 10 * 60,      # 美股/加密货币盘中会变化
+}
+DEFAULT_TTL = 3600
+
+_lock = threading.Lock()
+# 每个 (source, symbol) 一把锁：同一数据同时被多处请求时只下载一次，其余等待后直接命中缓存
+_fetch_locks = {}
+_fetch_locks_lock = threading.Lock()
+
+
+def _load_ttls():
+    ttls = dict(DEFAULT_TTLS)
+    for item in os.environ.get("MARKET_CACHE_TTL", "").split(","):
+        if "=" in item:
+            source, seconds = item.split("=", 1)
+            try:
+                ttls[source.strip()] = float(seconds)
+            except ValueError:
+                print(f"⚠️ 无效的缓存TTL配置: {item}")
+    return ttls
+
+
+SOURCE_TTLS = _load_ttls()
+
+
+def trading_date():
+    """缓存键中使用的交易日（本地日期，Actions中TZ=Asia/Shanghai）"""
+    return datetime.now().strftime('%Y%m%d')
+
+
+def _connect():
+    os.makedirs(os.path.dirname(CACHE_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(CACHE_PATH, timeout=30)
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS cache (
+            source TEXT NOT NULL,
+            symbol TEXT NOT NULL,
+            trade_date TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            last_access REAL NOT NULL,
+            size INTEGER NOT NULL,
+            payload BLOB NOT NULL,
+            PRIMARY KEY (source, symbol, trade_date)
+        )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_last_access ON cache(last_access)")
+    return conn
+
+
+def get(source, symbol, ttl=None):
+    """读取缓存，未命中或已过期返回None"""
+    if not CACHE_ENABLED:
+        return None
+    ttl = SOURCE_TTLS.get(source, DEFAULT_TTL) if ttl is None else ttl
+    now = time.time()
+    try:
+        with _lock:
+            conn = _connect()
+            try:
+                row = conn.execute(
+                    "SELECT created_at, payload FROM cache WHERE source=? AND symbol=? AND trade_date=?",
+                    (source, symbol, trading_date())).fetchone()
+                if row is None or now - row[0] > ttl:
+                    return None
+                conn.execute(
+                    "UPDATE cache SET last_access=? WHERE source=? AND symbol=? AND trade_date=?",
+                    (now, source, symbol, trading_date()))
+                conn.commit()
+            finally:
+                conn.close()
+        return pickle.loads(row[1])
+    except Exception as e:
+        print(f"⚠️ 读取缓存失败({source}:{symbol}): {e}")
+        return None
+
+
+def put(source, symbol, value):
+    """写入缓存，并在超出容量时按最近访问时间淘汰"""
+    if not CACHE_ENABLED:
+        return
+    try:
+        payload = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        with _lock:
+            conn = _connect()
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (source, symbol, trading_date(), now, now, len(payload), payload))
+                _evict(conn)
+                conn.commit()
+            finally:
+                conn.close()
+    except Exception as e:
+        print(f"⚠️ 写入缓存失败({source}:{symbol}): {e}")
+
+
+def _evict(conn):
+    total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM cache").fetchone()[0]
+    if total <= CACHE_MAX_BYTES:
+        return
+    rows = conn.execute("SELECT source, symbol, trade_date, size FROM cache ORDER BY last_access").fetchall()
+    for source, symbol, day, size in rows:
+        if total <= CACHE_MAX_BYTES:
+            break
+        conn.execute("DELETE FROM cache WHERE source=? AND symbol=? AND trade_date=?", (source, symbol, day))
+        total -= size
+
+
+def _is_empty(value):
+    if value is None:
+        return True
+    empty = getattr(value, "empty", False)
+    return empty is True
+
+
+def _fetch_lock(source, symbol):
+    with _fetch_locks_lock:
+        return _fetch_locks.setdefault((source, symbol), threading.Lock())
+
+
+def cached_fetch(source, symbol, fetch_func, ttl=None):
+    """优先从缓存获取数据，未命中时调用fetch_func并写入缓存（空结果不缓存）
+
+    同一 (source, symbol) 的并发调用只有一个执行fetch_func，其余等待其写入缓存后读取。
+    """
+    with _fetch_lock(source, symbol):
+        start_time = time.time()
+        value = get(source, symbol, ttl)
+        if value is not None:
+            print(f"💾 缓存命中: {source}:{symbol}")
+            metrics.record("cache", source, time.time() - start_time, start=start_time, symbol=symbol, hit=True)
+            return value
+        with metrics.span("cache", source, symbol=symbol, hit=False):
+            value = fetch_func()
+        if not _is_empty(value):
+            put(source, symbol, value)
+        return value
+
+
+def _connect_bars():
+    conn = _connect()
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS index_bars (
+            symbol TEXT NOT NULL,
+            date TEXT NOT NULL,
+            open REAL,
+            high REAL,
+            low REAL,
+            close REAL NOT NULL,
+            volume REAL,
+            PRIMARY KEY (symbol, date)
+        )""")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS index_bars_meta (
+            symbol TEXT PRIMARY KEY,
+            checked_at REAL NOT NULL
+        )""")
+    return conn
+
+
+def index_history_tail(symbol, fetch_range, n=2, bootstrap_days=30, ttl=None):
+    """增量维护指数日线并返回最近n根K线
+
+    本地只追加保存每个指数的日线，每次仅调用 fetch_range(symbol, start_date, end_date)
+    拉取缺失区间（从已保存的最后一天开始，以便覆盖盘中未收盘的K线）。
+    fetch_range 返回含 date/open/high/low/close/volume 列的DataFrame。
+    返回按日期升序排列的DataFrame，没有数据时返回None。
+    """
+    import pandas as pd
+
+    ttl = SOURCE_TTLS.get("akshare", DEFAULT_TTL) if ttl is None else ttl
+    today = datetime.now()
+    with _lock:
+        conn = _connect_bars()
+        try:
+            last_date, = conn.execute("SELECT MAX(date) FROM index_bars WHERE symbol=?", (symbol,)).fetchone()
+            meta = conn.execute("SELECT checked_at FROM index_bars_meta WHERE symbol=?", (symbol,)).fetchone()
+        finally:
+            conn.close()
+
+    fresh = CACHE_ENABLED and meta is not None and time.time() - meta[0] <= ttl
+    if not fresh:
+        if last_date and CACHE_ENABLED:
+            start_date = last_date.replace('-', '')
+        else:
+            start_date = (today - timedelta(days=bootstrap_days)).strftime('%Y%m%d')
+        end_date = today.strftime('%Y%m%d')
+        print(f"🔍 增量获取{symbol}日线: {start_date} ~ {end_date}")
+        bars = fetch_range(symbol, start_date, end_date)
+        if bars is not None and not bars.empty:
+            dates = pd.to_datetime(bars['date']).dt.strftime('%Y-%m-%d').tolist()
+            values = bars.reindex(columns=['open', 'high', 'low', 'close', 'volume']).to_numpy(dtype=float).tolist()
+            rows = [(date, *row) for date, row in zip(dates, values)]
+            with _lock:
+                conn = _connect_bars()
+                try:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO index_bars VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        [(symbol, *row) for row in rows])
+                    conn.execute("INSERT OR REPLACE INTO index_bars_meta VALUES (?, ?)", (symbol, time.time()))
+                    conn.commit()
+                finally:
+                    conn.close()
+
+    with _lock:
+        conn = _connect_bars()
+        try:
+            tail = pd.read_sql_query(
+                "SELECT date, open, high, low, close, volume FROM index_bars "
+                "WHERE symbol=? ORDER BY date DESC LIMIT ?", conn, params=(symbol, n))
+        finally:
+            conn.close()
+    if tail.empty:
+        return None
+    return tail.iloc[::-1].reset_index(drop=True)
+
+
+def clear():
+    with _lock:
+        conn = _connect()
+        try:
+            conn.execute("DELETE FROM cache")
+            conn.execute("DROP TABLE IF EXISTS index_bars")
+            conn.execute("DROP TABLE IF EXISTS index_bars_meta")
+            conn.commit()
+            conn.execute("VACUUM")
+        finally:
+            conn.close()
+
+
+def stats():
+    with _lock:
+        conn = _connect()
+        try:
+            return conn.execute(
+                "SELECT source, COUNT(*), COALESCE(SUM(size), 0) FROM cache GROUP BY source").fetchall()
+        finally:
+            conn.close()
+
+
+if __name__ == '__main__':
+    if "--clear" in sys.argv:
+        clear()
+        print(f"🧹 已清空缓存: {CACHE_PATH}")
+    else:
+        print(f"💾 缓存文件: {CACHE_PATH}")
+        for source, count, size in stats():
+            print(f"  {source}: {count}条, {size / 1024:.1f}KB")
@@ -0,0 +1,156 @@
+# 运行指标 - 记录获取函数、备用数据源尝试、HTTP请求和缓存命中的耗时，导出JSON Lines追踪文件和Prometheus文本格式
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+# 设为空字符串可关闭对应输出
+TRACE_FILE = os.environ.get("METRICS_TRACE_FILE", os.path.join(_CACHE_DIR, "trace.jsonl"))
+PROMETHEUS_FILE = os.environ.get("METRICS_PROM_FILE", os.path.join(_CACHE_DIR, "metrics.prom"))
+
+RUN_ID = datetime.now().strftime("%Y%m%dT%H%M%S")
+
+_spans = []
+_spans_lock = threading.Lock()
+
+
+def record(kind, name, duration, status="ok", start=None, **attrs):
+    """记录一个已结束的span
+
+    kind 为 fetcher / source / http / cache，name 为函数名、数据源名或主机名。
+    """
+    span_record = {
+        "run_id": RUN_ID,
+        "kind": kind,
+        "name": name,
+        "start": start if start is not None else time.time() - duration,
+        "duration": round(duration, 6),
+        "status": status,
+    }
+    span_record.update(attrs)
+    with _spans_lock:
+        _spans.append(span_record)
+    return span_record
+
+
+class span:
+    """with块计时：正常结束记为ok，抛出异常记为error，可用set()补充属性或修改状态"""
+
+    def __init__(self, kind, name, **attrs):
+        self.kind = kind
+        self.name = name
+        self.attrs = attrs
+        self.status = "ok"
+        self.duration = None
+
+    def set(self, status=None, **attrs):
+        if status is not None:
+            self.status = status
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        self._start = time.time()
+        self._perf_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and self.status == "ok":
+            self.status = "error"
+            self.attrs.setdefault("error", str(exc)[:200])
+        self.duration = time.perf_counter() - self._perf_start
+        record(self.kind, self.name, self.duration, status=self.status, start=self._start, **self.attrs)
+        return False
+
+
+def spans(kind=None):
+    with _spans_lock:
+        return [s for s in _spans if kind is None or s["kind"] == kind]
+
+
+def reset():
+    with _spans_lock:
+        _spans.clear()
+
+
+def export_jsonl(path=TRACE_FILE):
+    """把本次运行的span追加到JSON Lines文件（多次运行累积，便于跨运行分析）"""
+    if not path:
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "a", encoding="utf-8") as f:
+        for span_record in spans():
+            f.write(json.dumps(span_record, ensure_ascii=False) + "\n")
+
+
+def _label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels):
+    return "{" + ",".join(f'{key}="{_label_value(value)}"' for key, value in labels.items()) + "}"
+
+
+def prometheus_text():
+    """按 kind/name/chain/status 聚合为Prometheus文本格式"""
+    durations = {}
+    http_bytes = {}
+    cache_results = {}
+    for span_record in spans():
+        key = (span_record["kind"], span_record["name"], span_record.get("chain", ""), span_record["status"])
+        count, total, longest = durations.get(key, (0, 0.0, 0.0))
+        durations[key] = (count + 1, total + span_record["duration"], max(longest, span_record["duration"]))
+        if span_record["kind"] == "http":
+            http_bytes[span_record["name"]] = http_bytes.get(span_record["name"], 0) + span_record.get("bytes", 0)
+        if span_record["kind"] == "cache":
+            cache_key = (span_record["name"], "hit" if span_record.get("hit") else "miss")
+            cache_results[cache_key] = cache_results.get(cache_key, 0) + 1
+
+    lines = [
+        "# HELP report_span_duration_seconds Duration of fetchers, fallback attempts and HTTP requests.",
+        "# TYPE report_span_duration_seconds summary",
+    ]
+    for (kind, name, chain, status), (count, total, _) in sorted(durations.items()):
+        labels = _labels(kind=kind, name=name, chain=chain, status=status)
+        lines.append(f"report_span_duration_seconds_count{labels} {count}")
+        lines.append(f"report_span_duration_seconds_sum{labels} {total:.6f}")
+    lines += [
+        "# HELP report_span_duration_seconds_max Longest single span.",
+        "# TYPE report_span_duration_seconds_max gauge",
+    ]
+    for (kind, name, chain, status), (_, _, longest) in sorted(durations.items()):
+        labels = _labels(kind=kind, name=name, chain=chain, status=status)
+        lines.append(f"report_span_duration_seconds_max{labels} {longest:.6f}")
+    lines += [
+        "# HELP report_http_response_bytes_total Response body bytes per host.",
+        "# TYPE report_http_response_bytes_total counter",
+    ]
+    for host, total_bytes in sorted(http_bytes.items()):
+        lines.append(f"report_http_response_bytes_total{_labels(host=host)} {total_bytes}")
+    lines += [
+        "# HELP report_cache_requests_total Market data cache lookups.",
+        "# TYPE report_cache_requests_total counter",
+    ]
+    for (source, result), count in sorted(cache_results.items()):
+        lines.append(f"report_cache_requests_total{_labels(source=source, result=result)} {count}")
+    return "\n".join(lines) + "\n"
+
+
+def export_prometheus(path=PROMETHEUS_FILE):
+    if not path:
+        return
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(prometheus_text())
+
+
+def export():
+    """输出追踪文件和Prometheus指标"""
+    try:
+        export_jsonl()
+        export_prometheus()
+        if TRACE_FILE or PROMETHEUS_FILE:
+            print(f"📈 已输出运行指标: {TRACE_FILE or '-'} / {PROMETHEUS_FILE or '-'}")
+    except OSError as e:
+        print(f"⚠️ 输出运行指标失败: {e}")
@@ -0,0 +1,291 @@
+# 录制/回放 - 把上游HTTP响应和akshare/yfinance/tushare调用结果（连同真实耗时）保存为fixture，
+# 回放时由本地替身HTTP服务器和库代理按原耗时返回，可注入额外延迟和失败，用于无网络环境下的稳定基准测试
+import atexit
+import base64
+import hashlib
+import http.server
+import json
+import os
+import pickle
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import parse_qsl, urlsplit
+
+import metrics
+
+# REPLAY_MODE: record（真实请求并保存fixture）/ replay（只使用fixture，不访问网络）/ 空（关闭）
+MODE = os.environ.get("REPLAY_MODE", "").strip().lower()
+FIXTURE_DIR = os.environ.get(
+    "REPLAY_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "replay"))
+# 外部启动的替身服务器地址（如 http://127.0.0.1:8765），为空时回放模式在进程内自动启动
+SERVER_URL = os.environ.get("REPLAY_SERVER", "").rstrip("/")
+LATENCY_SCALE = float(os.environ.get("REPLAY_LATENCY_SCALE", "1"))
+EXTRA_LATENCY = float(os.environ.get("REPLAY_EXTRA_LATENCY", "0"))
+FAILURE_RATE = float(os.environ.get("REPLAY_FAILURE_RATE", "0"))
+# 总是失败的主机或库函数（逗号分隔，如 stock.xueqiu.com,akshare.stock_index_pe_lg）
+FAIL_TARGETS = {t.strip() for t in os.environ.get("REPLAY_FAIL", "").split(",") if t.strip()}
+SEED = int(os.environ.get("REPLAY_SEED", "0"))
+
+# 不写入fixture、也不参与匹配的参数（密钥和token）
+SECRET_FIELDS = {"key", "access_token", "appid", "secret", "token", "api_key", "apikey"}
+_DATE_RE = re.compile(r"\b(19|20)\d{2}-?\d{2}-?\d{2}\b")
+
+_random = random.Random(SEED)
+_random_lock = threading.Lock()
+_state_dir = None
+_server = None
+_server_lock = threading.Lock()
+
+
+def state_path(path):
+    """回放模式下把本地状态文件（缓存、token、健康记录等）换到本进程独享的临时目录
+
+    这样回放既不会读到真实运行留下的状态，也不会把回放数据写回去，每次回放的起点相同。
+    """
+    global _state_dir
+    if MODE != "replay":
+        return path
+    if _state_dir is None:
+        _state_dir = tempfile.mkdtemp(prefix="replay-state-")
+        atexit.register(shutil.rmtree, _state_dir, ignore_errors=True)
+    return os.path.join(_state_dir, os.path.basename(path))
+
+
+def _fingerprint(*parts):
+    """匹配用的指纹：去掉密钥参数，日期统一替换为<date>，使fixture在其他日期也能回放"""
+    text = _DATE_RE.sub("<date>", json.dumps(parts, ensure_ascii=False, sort_keys=True, default=repr))
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+def _public_params(url, params):
+    query = dict(parse_qsl(urlsplit(url).query))
+    if isinstance(params, dict):
+        query.update({k: str(v) for k, v in params.items()})
+    return {k: v for k, v in sorted(query.items()) if k.lower() not in SECRET_FIELDS}
+
+
+def http_key(method, url, params=None):
+    parts = urlsplit(url)
+    return f"{parts.netloc}-{_fingerprint(method.upper(), parts.netloc, parts.path, _public_params(url, params))}"
+
+
+def _scrub_body(content, content_type):
+    """JSON响应中的token字段替换为占位符，避免把真实凭证写入fixture"""
+    if "json" not in (content_type or "") and content[:1] not in (b"{", b"["):
+        return content
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return content
+    if isinstance(data, dict) and SECRET_FIELDS & set(data):
+        data = {k: ("REPLAY_" + k.upper() if k in SECRET_FIELDS else v) for k, v in data.items()}
+        return json.dumps(data, ensure_ascii=False).encode("utf-8")
+    return content
+
+
+def _write(path, data, binary=False):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "wb" if binary else "w", **({} if binary else {"encoding": "utf-8"})) as f:
+        if binary:
+            pickle.dump(data, f)
+        else:
+            json.dump(data, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def record_http(method, url, params, response, elapsed):
+    """录制模式下保存一次HTTP响应"""
+    content_type = response.headers.get("Content-Type", "")
+    fixture = {
+        "method": method.upper(),
+        "url": url.split("?")[0],
+        "params": _public_params(url, params),
+        "status": response.status_code,
+        "content_type": content_type,
+        "body": base64.b64encode(_scrub_body(response.content or b"", content_type)).decode("ascii"),
+        "elapsed": elapsed,
+        "recorded_at": time.time(),
+    }
+    try:
+        _write(os.path.join(FIXTURE_DIR, "http", http_key(method, url, params) + ".json"), fixture)
+    except OSError as e:
+        print(f"⚠️ 保存HTTP fixture失败: {e}")
+
+
+def _should_fail(target):
+    if target in FAIL_TARGETS or target.split(".")[0] in FAIL_TARGETS:
+        return True
+    if FAILURE_RATE <= 0:
+        return False
+    with _random_lock:
+        return _random.random() < FAILURE_RATE
+
+
+def _replay_delay(elapsed):
+    return max(0.0, elapsed * LATENCY_SCALE + EXTRA_LATENCY)
+
+
+class _ReplayHandler(http.server.BaseHTTPRequestHandler):
+    """替身服务器：/fixture/<key> 返回对应fixture，按录制时的耗时延迟"""
+
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status, body, content_type="text/plain; charset=utf-8"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if length:
+            self.rfile.read(length)
+        key = self.path.split("?")[0].rsplit("/", 1)[-1]
+        try:
+            with open(os.path.join(FIXTURE_DIR, "http", key + ".json"), encoding="utf-8") as f:
+                fixture = json.load(f)
+        except (OSError, ValueError):
+            self._send(404, f"no fixture: {key}".encode("utf-8"))
+            return
+        time.sleep(_replay_delay(fixture["elapsed"]))
+        if _should_fail(urlsplit(fixture["url"]).netloc):
+            self._send(503, b"injected failure")
+            return
+        self._send(fixture["status"], base64.b64decode(fixture["body"]), fixture["content_type"] or "text/plain")
+
+    do_GET = do_POST = do_PUT = do_DELETE = _handle
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port=0):
+    """启动替身服务器并返回 (server, url)"""
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", port), _ReplayHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="replay-server").start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def server_url():
+    global _server, SERVER_URL
+    with _server_lock:
+        if not SERVER_URL:
+            _server, SERVER_URL = serve()
+            print(f"🎞️ 回放服务器已启动: {SERVER_URL}（fixture目录 {FIXTURE_DIR}）")
+        return SERVER_URL
+
+
+def route(method, url, kwargs):
+    """回放模式下把请求改发到替身服务器，返回新的url和请求参数（密钥参数不再发送）"""
+    kwargs = dict(kwargs)
+    params = kwargs.pop("params", None)
+    return f"{server_url()}/fixture/{http_key(method, url, params)}", kwargs
+
+
+class RecordingLibrary:
+    """录制模式的库代理：调用真实函数并保存返回值（或异常）和耗时"""
+
+    def __init__(self, name, target):
+        self._name = name
+        self._target = target
+
+    def __getattr__(self, attr):
+        value = getattr(self._target, attr)
+        if not callable(value):
+            return value
+        qualified = f"{self._name}.{attr}"
+
+        def call(*args, **kwargs):
+            path = _library_path(qualified, args, kwargs)
+            start_time = time.perf_counter()
+            try:
+                result = value(*args, **kwargs)
+            except Exception as e:
+                _save_library(path, {"error": f"{type(e).__name__}: {e}",
+                                     "elapsed": time.perf_counter() - start_time})
+                raise
+            _save_library(path, {"result": result, "elapsed": time.perf_counter() - start_time})
+            return result
+        return call
+
+
+class ReplayLibrary:
+    """回放模式的库代理：不导入真实库，按参数查找fixture并按录制耗时返回
+
+    每次调用记录一个 library 类型的span（含fixture字节数），与HTTP请求一起计入请求统计。
+    """
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attr):
+        qualified = f"{self._name}.{attr}"
+
+        def call(*args, **kwargs):
+            path = _library_path(qualified, args, kwargs)
+            with metrics.span("library", qualified) as call_span:
+                try:
+                    with open(path, "rb") as f:
+                        payload = f.read()
+                except OSError:
+                    raise LookupError(f"没有录制 {qualified} 的fixture: {os.path.basename(path)}")
+                fixture = pickle.loads(payload)
+                call_span.set(bytes=len(payload))
+                time.sleep(_replay_delay(fixture["elapsed"]))
+                if _should_fail(qualified):
+                    raise ConnectionError(f"回放注入失败: {qualified}")
+                if "error" in fixture:
+                    raise RuntimeError(fixture["error"])
+                return fixture["result"]
+        return call
+
+
+def _library_path(qualified, args, kwargs):
+    return os.path.join(FIXTURE_DIR, "lib", f"{qualified}-{_fingerprint(qualified, args, kwargs)}.pkl")
+
+
+def _save_library(path, fixture):
+    try:
+        _write(path, fixture, binary=True)
+    except (OSError, pickle.PicklingError) as e:
+        print(f"⚠️ 保存库调用fixture失败: {e}")
+
+
+def library(name, module):
+    """按当前模式包装第三方数据库模块（如 akshare、yfinance、tushare pro客户端）"""
+    if MODE == "record":
+        return RecordingLibrary(name, module)
+    if MODE == "replay":
+        return ReplayLibrary(name)
+    return module
+
+
+def list_fixtures():
+    for kind in ("http", "lib"):
+        directory = os.path.join(FIXTURE_DIR, kind)
+        names = sorted(os.listdir(directory)) if os.path.isdir(directory) else []
+        print(f"📁 {kind}: {len(names)}个fixture")
+        for name in names:
+            print(f"   {name}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == "serve":
+        port = int(sys.argv[2]) if len(sys.argv) > 2 else 8765
+        _, url = serve(port)
+        print(f"🎞️ 回放服务器: {url}（fixture目录 {FIXTURE_DIR}），Ctrl+C退出")
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+    else:
+        list_fixtures()
@@ -0,0 +1,293 @@
+# 历史运行记录 - 每次运行的报告数值和各数据源耗时保存到SQLite（按日期建索引），命令行查看滚动统计
+import os
+import re
+import sys
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+import lazy_import
+import replay
+
+pd = lazy_import.lazy("pandas")
+np = lazy_import.lazy("numpy")
+
+HISTORY_ENABLED = os.environ.get("REPORT_HISTORY", "1") != "0"
+HISTORY_PATH = replay.state_path(os.environ.get(
+    "REPORT_HISTORY_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "report_history.sqlite")))
+
+# runs表中的数值列
+RUN_COLUMNS = [
+    "sh_index", "sh_change", "hs300_index", "hs300_change", "hs300_pe", "bond_yield", "risk_premium",
+    "dji", "nasdaq", "sp500", "usdcny", "bitcoin", "ethereum",
+]
+
+_lock = threading.Lock()
+_NUMBER_RE = re.compile(r"[-+]?\d[\d,]*\.?\d*")
+
+
+def _connect():
+    os.makedirs(os.path.dirname(HISTORY_PATH) or ".", exist_ok=True)
+    conn = sqlite3.connect(HISTORY_PATH, timeout=30)
+    columns = ",\n            ".join(f"{name} REAL" for name in RUN_COLUMNS)
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS runs (
+            run_id TEXT PRIMARY KEY,
+            date TEXT NOT NULL,
+            started_at REAL NOT NULL,
+            duration REAL,
+            fallbacks TEXT NOT NULL DEFAULT '',
+            {columns}
+        )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_runs_date ON runs(date)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS source_latency (
+            run_id TEXT NOT NULL,
+            date TEXT NOT NULL,
+            kind TEXT NOT NULL,
+            name TEXT NOT NULL,
+            chain TEXT NOT NULL DEFAULT '',
+            status TEXT NOT NULL,
+            duration REAL NOT NULL
+        )""")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_source_latency_date ON source_latency(date)")
+    # 每个交易日一行的风险溢价序列，统计历史分位数时不需要重新下载PE和国债收益率全量历史
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS risk_premium_daily (
+            date TEXT PRIMARY KEY,
+            hs300_pe REAL NOT NULL,
+            bond_yield REAL NOT NULL,
+            risk_premium REAL NOT NULL,
+            source TEXT NOT NULL
+        )""")
+    return conn
+
+
+def parse_number(text, index=0):
+    """从 "3234.12 (+0.52%)"、"$67,890"、"1.799%" 等报告文本中取第index个数字，失败返回None"""
+    if isinstance(text, (int, float)):
+        return float(text)
+    if not isinstance(text, str):
+        return None
+    matches = _NUMBER_RE.findall(text)
+    if len(matches) <= index:
+        return None
+    try:
+        return float(matches[index].replace(",", ""))
+    except ValueError:
+        return None
+
+
+def report_row(results, risk_premium):
+    """把collect_report_data的结果转换为runs表的一行数值（失败的项为None）"""
+    us = results.get("us") or {}
+    crypto = results.get("crypto") or {}
+    return {
+        "sh_index": parse_number(results.get("sh_index")),
+        "sh_change": parse_number(results.get("sh_index"), 1),
+        "hs300_index": parse_number(results.get("hs300_index")),
+        "hs300_change": parse_number(results.get("hs300_index"), 1),
+        "hs300_pe": parse_number(results.get("hs300_pe")),
+        "bond_yield": parse_number(results.get("bond")),
+        "risk_premium": parse_number(risk_premium),
+        "dji": parse_number(us.get("dji")),
+        "nasdaq": parse_number(us.get("nasdaq")),
+        "sp500": parse_number(us.get("sp500")),
+        "usdcny": parse_number(results.get("exchange")),
+        "bitcoin": parse_number(crypto.get("bitcoin")),
+        "ethereum": parse_number(crypto.get("ethereum")),
+    }
+
+
+def record_run(run_id, started_at, duration, results, risk_premium, spans, fallbacks=(), risk_point=None):
+    """保存一次运行的报告数值和fetcher/source/http耗时
+
+    fallbacks 为使用了默认值的结果项。risk_point 为历史序列口径的最新风险溢价
+    {"date", "hs300_pe", "bond_yield", "risk_premium"}，按数据自身的交易日写入日序列
+    （运行日期可能是周末或开盘前），该日期已有记录时保留原值。
+    """
+    if not HISTORY_ENABLED:
+        return
+    date = datetime.fromtimestamp(started_at).strftime('%Y-%m-%d')
+    row = report_row(results, risk_premium)
+    latency_rows = [
+        (run_id, date, s["kind"], s["name"], s.get("chain", ""), s["status"], s["duration"])
+        for s in spans if s["kind"] in ("fetcher", "source", "http")
+    ]
+    try:
+        with _lock:
+            conn = _connect()
+            try:
+                with conn:
+                    conn.execute(
+                        f"INSERT OR REPLACE INTO runs (run_id, date, started_at, duration, fallbacks, "
+                        f"{', '.join(RUN_COLUMNS)}) VALUES (?, ?, ?, ?, ?, {', '.join('?' * len(RUN_COLUMNS))})",
+                        (run_id, date, started_at, duration, ",".join(sorted(fallbacks)),
+                         *(row[name] for name in RUN_COLUMNS)))
+                    conn.executemany("INSERT INTO source_latency VALUES (?, ?, ?, ?, ?, ?, ?)", latency_rows)
+                    if risk_point is not None:
+                        conn.execute(
+                            "INSERT OR IGNORE INTO risk_premium_daily VALUES (?, ?, ?, ?, ?)",
+                            (pd.Timestamp(risk_point["date"]).strftime('%Y-%m-%d'), float(risk_point["hs300_pe"]),
+                             float(risk_point["bond_yield"]), float(risk_point["risk_premium"]), "report"))
+            finally:
+                conn.close()
+        print(f"🗂️ 已保存本次运行记录: {HISTORY_PATH}")
+    except sqlite3.Error as e:
+        print(f"⚠️ 保存运行记录失败: {e}")
+
+
+def backfill_risk_premium(frame, source):
+    """把历史风险溢价序列写入日序列（已有的日期保留原值），返回新增行数
+
+    frame 需要包含 date、hs300_pe、bond_yield、risk_premium 列。
+    """
+    if not HISTORY_ENABLED or frame is None or frame.empty:
+        return 0
+    rows = list(zip(pd.to_datetime(frame["date"]).dt.strftime('%Y-%m-%d'),
+                    frame["hs300_pe"].to_numpy(dtype=float).tolist(),
+                    frame["bond_yield"].to_numpy(dtype=float).tolist(),
+                    frame["risk_premium"].to_numpy(dtype=float).tolist(),
+                    [source] * len(frame)))
+    with _lock:
+        conn = _connect()
+        try:
+            with conn:
+                before = conn.total_changes
+                conn.executemany("INSERT OR IGNORE INTO risk_premium_daily VALUES (?, ?, ?, ?, ?)", rows)
+                return conn.total_changes - before
+        finally:
+            conn.close()
+
+
+def risk_premium_coverage():
+    """风险溢价日序列的 (行数, 最早日期, 最晚日期)，日期为 datetime 或 None"""
+    if not HISTORY_ENABLED:
+        return 0, None, None
+    with _lock:
+        conn = _connect()
+        try:
+            count, first, last = conn.execute(
+                "SELECT COUNT(*), MIN(date), MAX(date) FROM risk_premium_daily").fetchone()
+        finally:
+            conn.close()
+    parse = lambda value: datetime.strptime(value, '%Y-%m-%d') if value else None
+    return count, parse(first), parse(last)
+
+
+def _read_frame(query, params=()):
+    with _lock:
+        conn = _connect()
+        try:
+            return pd.read_sql_query(query, conn, params=params)
+        finally:
+            conn.close()
+
+
+def load_runs(days=None):
+    since = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d') if days else "0000-00-00"
+    return _read_frame("SELECT * FROM runs WHERE date >= ? ORDER BY started_at", (since,))
+
+
+def load_latencies(days=None):
+    since = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d') if days else "0000-00-00"
+    return _read_frame("SELECT * FROM source_latency WHERE date >= ?", (since,))
+
+
+def load_risk_premium(years=None):
+    """风险溢价日序列（按日期升序）"""
+    since = (datetime.now() - timedelta(days=int(365.25 * years))).strftime('%Y-%m-%d') if years else "0000-00-00"
+    frame = _read_frame("SELECT * FROM risk_premium_daily WHERE date >= ? ORDER BY date", (since,))
+    frame["date"] = pd.to_datetime(frame["date"])
+    return frame
+
+
+def percentile_of_last(values):
+    """序列最后一个值在整个序列中的分位数（百分比）"""
+    values = np.asarray(values, dtype=float)
+    return float((values <= values[-1]).mean() * 100)
+
+
+def risk_premium_context(value, years=5, quantiles=(10, 25, 50, 75, 90)):
+    """value 在最近years年风险溢价日序列中的位置
+
+    返回 {"percentile", "bands": {q: 值}, "count"}，历史不足时返回None。
+    """
+    if value is None:
+        return None
+    frame = load_risk_premium(years)
+    if len(frame) < 2:
+        return None
+    values = np.sort(frame["risk_premium"].to_numpy(dtype=float))
+    return {
+        "percentile": float(np.searchsorted(values, value, side="right") / len(values) * 100),
+        "bands": dict(zip(quantiles, np.percentile(values, quantiles).tolist())),
+        "count": len(values),
+    }
+
+
+def latency_summary(days=30):
+    """各数据源耗时的 p50/p95/成功率，按 kind/chain/name 分组"""
+    frame = load_latencies(days)
+    if frame.empty:
+        return frame
+    frame["ok"] = frame["status"] == "ok"
+    grouped = frame.groupby(["kind", "chain", "name"])
+    summary = grouped["duration"].quantile([0.5, 0.95]).unstack()
+    summary.columns = ["p50", "p95"]
+    summary["count"] = grouped.size()
+    summary["success_rate"] = grouped["ok"].mean() * 100
+    return summary.reset_index().sort_values(["kind", "chain", "p95"], ascending=[True, True, False])
+
+
+def print_dashboard(years=5, days=30):
+    """打印风险溢价历史分位数、最近运行数值和数据源耗时统计"""
+    print(f"🗂️ 运行记录: {HISTORY_PATH}")
+    risk_frame = load_risk_premium(years)
+    if risk_frame.empty:
+        print("📉 暂无风险溢价历史")
+    else:
+        values = risk_frame["risk_premium"].to_numpy(dtype=float)
+        bands = np.percentile(values, [10, 25, 50, 75, 90])
+        latest = risk_frame.iloc[-1]
+        percentile = percentile_of_last(values)
+        print(f"📉 风险溢价（最近{years}年，{len(values)}个交易日，"
+              f"{risk_frame['date'].iloc[0]:%Y-%m-%d} ~ {latest['date']:%Y-%m-%d}）")
+        print(f"   最新: {latest['risk_premium']:.3f}%  历史分位: {percentile:.1f}%")
+        print("   分位带: " + "  ".join(f"P{q}={v:.3f}%" for q, v in zip((10, 25, 50, 75, 90), bands)))
+        rolling = risk_frame.set_index("date")["risk_premium"].rolling("365D", min_periods=1).mean()
+        print(f"   近一年均值: {rolling.iloc[-1]:.3f}%")
+
+    runs = load_runs(days)
+    if not runs.empty:
+        print(f"📋 最近{days}天运行 {len(runs)} 次，平均耗时 {runs['duration'].mean():.1f}秒，"
+              f"最长 {runs['duration'].max():.1f}秒")
+        fallback_runs = runs["fallbacks"].str.len().gt(0).sum()
+        if fallback_runs:
+            print(f"   其中 {fallback_runs} 次有数据项使用了默认值")
+
+    summary = latency_summary(days)
+    if summary.empty:
+        print("⏱️ 暂无数据源耗时记录")
+        return
+    print(f"⏱️ 数据源耗时（最近{days}天）")
+    print(f"   {'类型':<8}{'链路':<10}{'名称':<28}{'次数':>6}{'成功率':>8}{'p50':>9}{'p95':>9}")
+    for row in summary.itertuples(index=False):
+        print(f"   {row.kind:<8}{row.chain or '-':<10}{row.name:<28}{row.count:>6}"
+              f"{row.success_rate:>7.0f}%{row.p50:>8.2f}s{row.p95:>8.2f}s")
+
+
+def _arg_value(flag, default):
+    if flag in sys.argv:
+        position = sys.argv.index(flag)
+        if position + 1 < len(sys.argv):
+            return float(sys.argv[position + 1])
+    return default
+
+
+if __name__ == '__main__':
+    start_time = time.time()
+    print_dashboard(years=int(_arg_value("--years", 5)), days=int(_arg_value("--days", 30)))
+    print(f"⏱️ 统计耗时: {time.time() - start_time:.2f}秒")
@@ -0,0 +1,176 @@
+# 数据源健康记录 - 按链路持久化每个备用数据源的成功率、耗时EWMA和熔断状态，据此调整尝试顺序
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+import replay
+
+HEALTH_ENABLED = os.environ.get("SOURCE_HEALTH", "1") != "0"
+HEALTH_PATH = replay.state_path(os.environ.get(
+    "SOURCE_HEALTH_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "source_health.json")))
+# 耗时EWMA的平滑系数（越大越看重最近几次）
+LATENCY_ALPHA = float(os.environ.get("SOURCE_HEALTH_ALPHA", "0.3"))
+# 连续失败达到该次数后熔断，熔断期间跳过该数据源；冷却期结束后放在最后试一次
+BREAKER_FAILURES = int(os.environ.get("SOURCE_BREAKER_FAILURES", "3"))
+BREAKER_COOLDOWN = float(os.environ.get("SOURCE_BREAKER_COOLDOWN_HOURS", "72")) * 3600
+# 耗时按该秒数分档，同一档内按权威顺序排列，避免零点几秒的抖动打乱顺序
+LATENCY_BUCKET = float(os.environ.get("SOURCE_LATENCY_BUCKET", "2"))
+
+
+def _load_authority():
+    """SOURCE_AUTHORITY 为 {"链路": ["数据源", ...]}，覆盖代码中的默认优先级（用于同档排序）"""
+    raw = os.environ.get("SOURCE_AUTHORITY", "").strip()
+    if not raw:
+        return {}
+    try:
+        return {chain: list(names) for chain, names in json.loads(raw).items()}
+    except (ValueError, AttributeError, TypeError) as e:
+        print(f"⚠️ SOURCE_AUTHORITY 格式错误，使用默认优先级: {e}")
+        return {}
+
+
+AUTHORITY = _load_authority()
+
+_lock = threading.Lock()
+_records = None
+
+
+def _load():
+    global _records
+    if _records is None:
+        try:
+            with open(HEALTH_PATH, encoding="utf-8") as f:
+                _records = json.load(f)
+        except (OSError, ValueError):
+            _records = {}
+    return _records
+
+
+def _save():
+    os.makedirs(os.path.dirname(HEALTH_PATH) or ".", exist_ok=True)
+    tmp_path = HEALTH_PATH + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(_records, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, HEALTH_PATH)
+
+
+def _key(chain, name):
+    return f"{chain}:{name}"
+
+
+def record(chain, name, status, duration):
+    """记录一次尝试：ok为成功，empty/error为失败，cancelled（竞速中被取消）不计入"""
+    if not HEALTH_ENABLED or not chain or status == "cancelled":
+        return
+    now = time.time()
+    with _lock:
+        entry = _load().setdefault(_key(chain, name), {
+            "attempts": 0, "successes": 0, "latency_ewma": None,
+            "consecutive_failures": 0, "last_success": None, "last_failure": None, "open_until": None,
+        })
+        entry["attempts"] += 1
+        if entry["latency_ewma"] is None:
+            entry["latency_ewma"] = duration
+        else:
+            entry["latency_ewma"] = LATENCY_ALPHA * duration + (1 - LATENCY_ALPHA) * entry["latency_ewma"]
+        if status == "ok":
+            entry["successes"] += 1
+            entry["consecutive_failures"] = 0
+            entry["last_success"] = now
+            entry["open_until"] = None
+        else:
+            entry["consecutive_failures"] += 1
+            entry["last_failure"] = now
+            if entry["consecutive_failures"] >= BREAKER_FAILURES:
+                if entry["open_until"] is None or entry["open_until"] <= now:
+                    print(f"🔌 {name}连续失败{entry['consecutive_failures']}次，熔断{BREAKER_COOLDOWN / 3600:.0f}小时")
+                entry["open_until"] = now + BREAKER_COOLDOWN
+        try:
+            _save()
+        except OSError as e:
+            print(f"⚠️ 保存数据源健康记录失败: {e}")
+
+
+def success_rate(entry):
+    """平滑后的成功率，没有记录的数据源视为可靠"""
+    return (entry["successes"] + 1) / (entry["attempts"] + 1)
+
+
+def order(chain, data_sources):
+    """按健康状况重排数据源（元素第一项为数据源名称）
+
+    排序依据依次为：成功率档位（>=80% / >=40% / 其余）、耗时EWMA档位、权威顺序。
+    熔断中的数据源被跳过；冷却期已过的放到最后试探。全部熔断时按权威顺序原样返回。
+    """
+    if not HEALTH_ENABLED or not chain:
+        return list(data_sources)
+    authority = AUTHORITY.get(chain, [])
+    now = time.time()
+
+    def authority_index(position, name):
+        return authority.index(name) if name in authority else len(authority) + position
+
+    with _lock:
+        records = _load()
+        healthy, probing, skipped = [], [], []
+        for position, source in enumerate(data_sources):
+            name = source[0]
+            entry = records.get(_key(chain, name))
+            if entry is None:
+                healthy.append(((0, 0, authority_index(position, name)), source))
+                continue
+            if entry["open_until"] is not None:
+                if entry["open_until"] > now:
+                    skipped.append(name)
+                else:
+                    probing.append(((0, 0, authority_index(position, name)), source))
+                continue
+            rate = success_rate(entry)
+            reliability_tier = 0 if rate >= 0.8 else 1 if rate >= 0.4 else 2
+            latency_tier = int((entry["latency_ewma"] or 0) // LATENCY_BUCKET)
+            healthy.append(((reliability_tier, latency_tier, authority_index(position, name)), source))
+
+    ordered = [source for _, source in sorted(healthy, key=lambda item: item[0])]
+    ordered += [source for _, source in sorted(probing, key=lambda item: item[0])]
+    if not ordered:
+        print(f"⚠️ {chain}的数据源全部熔断，按默认顺序尝试")
+        return [source for _, source in sorted(
+            enumerate(data_sources), key=lambda item: authority_index(item[0], item[1][0]))]
+    if skipped:
+        print(f"🔌 {chain}跳过熔断中的数据源: {', '.join(skipped)}")
+    return ordered
+
+
+def reset():
+    global _records
+    with _lock:
+        _records = {}
+        try:
+            os.remove(HEALTH_PATH)
+        except FileNotFoundError:
+            pass
+
+
+def print_scoreboard():
+    print(f"🩺 数据源健康记录: {HEALTH_PATH}")
+    now = time.time()
+    with _lock:
+        records = dict(_load())
+    for key, entry in sorted(records.items()):
+        state = "熔断中" if entry["open_until"] and entry["open_until"] > now else "正常"
+        last_failure = (datetime.fromtimestamp(entry["last_failure"]).strftime('%Y-%m-%d %H:%M')
+                        if entry["last_failure"] else "-")
+        print(f"  {key:<24} 成功{entry['successes']}/{entry['attempts']} "
+              f"耗时EWMA {entry['latency_ewma'] or 0:.2f}s 最近失败 {last_failure} {state}")
+
+
+if __name__ == '__main__':
+    if "--reset" in sys.argv:
+        reset()
+        print(f"🧹 已清空数据源健康记录: {HEALTH_PATH}")
+    else:
+        print_scoreboard()
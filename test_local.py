@@ -4,11 +4,18 @@
 本地测试脚本 - 用于调试综合日报功能
 使用方法：
 1. 设置环境变量
-2. 运行 python test_local.py
+2. 运行 python test_local.py（交互菜单）
+   或 python test_local.py --all [--timeout 秒] [--json 文件]（并发运行全部检查，输出JSON汇总）
 """
 
+import json
 import os
 import sys
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+# 非交互模式下每项检查的默认超时（秒）
+PROBE_TIMEOUT = float(os.environ.get("PROBE_TIMEOUT", "60"))
 
 def check_environment():
     """检查环境变量配置"""
@@ -144,6 +151,114 @@ def run_full_test():
         print(f"🔍 详细错误: {traceback.format_exc()}")
         return False
 
+def _probe_weather(report):
+    weather_data = report.get_weather(report.WEATHER_CITIES[0])
+    if weather_data is None:
+        raise Exception("天气数据获取失败")
+    return f"{weather_data[0]} {weather_data[2]} {weather_data[1]}"
+
+def _probe_wechat(report):
+    access_token = report.get_access_token()
+    if not access_token:
+        raise Exception("Access Token获取失败")
+    return access_token[:6] + "..."
+
+def _probe_pe(report):
+    pe_value = report.get_hs300_pe_ratio()
+    if pe_value is None:
+        raise Exception("所有PE数据源都失败")
+    return pe_value
+
+def _probe_bond(report):
+    bond_yield = report.get_bond_data()
+    if bond_yield is None or bond_yield == report.FALLBACK_BOND_YIELD:
+        raise Exception(f"所有数据源都失败，使用估算值{report.FALLBACK_BOND_YIELD}")
+    return bond_yield
+
+# 检查名称 -> 检查函数（参数为comprehensive_report模块，失败时抛出异常）
+PROBES = {
+    "weather": _probe_weather,
+    "wechat_token": _probe_wechat,
+    "hs300_pe": _probe_pe,
+    "bond": _probe_bond,
+}
+
+def run_all_probes(timeout=PROBE_TIMEOUT):
+    """并发运行环境检查和所有数据检查，返回汇总字典
+
+    comprehensive_report 只导入一次；每项检查在独立的截止时间内运行，超时后取消并记为timeout，
+    整体耗时约等于最慢的一项。
+    """
+    start_time = time.time()
+    summary = {"probes": {}}
+    
+    probe_start = time.time()
+    env_ok = check_environment()
+    summary["probes"]["environment"] = {"ok": env_ok, "status": "ok" if env_ok else "failed",
+                                        "seconds": round(time.time() - probe_start, 3)}
+    if not env_ok:
+        summary["probes"]["environment"]["error"] = "缺少必需的环境变量"
+    
+    import_start = time.time()
+    import comprehensive_report as report
+    import deadline
+    summary["import_seconds"] = round(time.time() - import_start, 3)
+    
+    def timed(probe):
+        probe_start = time.time()
+        try:
+            return probe(report), None, time.time() - probe_start
+        except Exception as e:
+            return None, e, time.time() - probe_start
+    
+    started = {}
+    for name, probe in PROBES.items():
+        probe_deadline = deadline.Deadline(timeout, name=name)
+        started[name] = (probe_deadline, deadline.spawn(timed, probe, deadline=probe_deadline))
+    
+    for name, (probe_deadline, future) in started.items():
+        try:
+            value, error, seconds = future.result(timeout=probe_deadline.remaining())
+        except (FutureTimeoutError, deadline.DeadlineExceeded):
+            probe_deadline.cancel()
+            summary["probes"][name] = {"ok": False, "status": "timeout", "seconds": timeout,
+                                       "error": f"超过{timeout}秒未完成"}
+            continue
+        if error is None:
+            summary["probes"][name] = {"ok": True, "status": "ok", "seconds": round(seconds, 3),
+                                       "result": value if isinstance(value, (int, float, str)) else repr(value)}
+        else:
+            summary["probes"][name] = {"ok": False, "status": "failed", "seconds": round(seconds, 3),
+                                       "error": str(error)[:500]}
+    
+    summary["ok"] = all(probe["ok"] for probe in summary["probes"].values())
+    summary["total_seconds"] = round(time.time() - start_time, 3)
+    return summary
+
+def run_non_interactive():
+    """--all 模式：输出JSON汇总（--json 指定文件时写入文件），全部通过时返回0"""
+    timeout = PROBE_TIMEOUT
+    if "--timeout" in sys.argv:
+        timeout = float(sys.argv[sys.argv.index("--timeout") + 1])
+    summary = run_all_probes(timeout)
+    
+    print("\n📋 检查结果:")
+    for name, probe in summary["probes"].items():
+        icon = "✅" if probe["ok"] else ("⌛" if probe["status"] == "timeout" else "❌")
+        detail = probe.get("result", probe.get("error", ""))
+        print(f"  {icon} {name:<14} {probe['seconds']:>7.2f}秒  {detail}")
+    print(f"⏱️ 总耗时: {summary['total_seconds']:.2f}秒（导入 {summary['import_seconds']:.2f}秒）")
+    
+    summary_json = json.dumps(summary, ensure_ascii=False, indent=2)
+    if "--json" in sys.argv:
+        path = sys.argv[sys.argv.index("--json") + 1]
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(summary_json)
+        print(f"💾 汇总已写入: {path}")
+    else:
+        print(summary_json)
+    return 0 if summary["ok"] else 1
+
 def main():
     """主测试函数"""
     print("=" * 60)
@@ -193,4 +308,6 @@ def main():
         return 1
 
 if __name__ == '__main__':
+    if "--all" in sys.argv:
+        sys.exit(run_non_interactive())
     sys.exit(main())
\ No newline at end of file
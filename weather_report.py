@@ -1,8 +1,11 @@
-# 安装依赖 pip3 install requests html5lib bs4 schedule
+# 安装依赖 pip3 install requests lxml html5lib bs4 schedule
 import os
-import requests
+import http_client
+import wechat_client
+import market_cache
 import json
-from bs4 import BeautifulSoup
+import concurrent.futures
+from bs4 import BeautifulSoup, SoupStrainer
 
 # 从测试号信息获取
 appID = os.environ.get("APP_ID")
@@ -12,66 +15,120 @@ openId = os.environ.get("OPEN_ID")
 # 天气预报模板ID
 weather_template_id = os.environ.get("TEMPLATE_ID")
 
-def get_weather(my_city):
-    urls = ["http://www.weather.com.cn/textFC/hb.shtml",
-            "http://www.weather.com.cn/textFC/db.shtml",
-            "http://www.weather.com.cn/textFC/hd.shtml",
-            "http://www.weather.com.cn/textFC/hz.shtml",
-            "http://www.weather.com.cn/textFC/hn.shtml",
-            "http://www.weather.com.cn/textFC/xb.shtml",
-            "http://www.weather.com.cn/textFC/xn.shtml"
-            ]
-    for url in urls:
-        resp = requests.get(url)
-        text = resp.content.decode("utf-8")
-        soup = BeautifulSoup(text, 'html5lib')
-        div_conMidtab = soup.find("div", class_="conMidtab")
-        tables = div_conMidtab.find_all("table")
-        for table in tables:
-            trs = table.find_all("tr")[2:]
-            for index, tr in enumerate(trs):
-                tds = tr.find_all("td")
+REGION_URLS = ["http://www.weather.com.cn/textFC/hb.shtml",
+               "http://www.weather.com.cn/textFC/db.shtml",
+               "http://www.weather.com.cn/textFC/hd.shtml",
+               "http://www.weather.com.cn/textFC/hz.shtml",
+               "http://www.weather.com.cn/textFC/hn.shtml",
+               "http://www.weather.com.cn/textFC/xb.shtml",
+               "http://www.weather.com.cn/textFC/xn.shtml"
+               ]
+
+# 城市索引缓存一天（缓存键包含日期）
+CITY_INDEX_TTL = 24 * 3600
+_city_index = None
+
+
+def parse_region_page(text, parser='lxml'):
+    # 一次解析整个地区页面，返回 {城市: (城市, 温度, 天气, 风向)}
+    # 只解析当天预报所在的 div.conMidtab，lxml比html5lib快一个数量级
+    parse_only = SoupStrainer("div", class_="conMidtab") if parser != 'html5lib' else None
+    soup = BeautifulSoup(text, parser, parse_only=parse_only)
+    div_conMidtab = soup.find("div", class_="conMidtab")
+    index = {}
+    if div_conMidtab is None:
+        return index
+    tables = div_conMidtab.find_all("table")
+    for table in tables:
+        trs = table.find_all("tr")[2:]
+        for tr in trs:
+            tds = tr.find_all("td")
+            try:
                 # 这里倒着数，因为每个省会的td结构跟其他不一样
-                city_td = tds[-8]
-                this_city = list(city_td.stripped_strings)[0]
-                if this_city == my_city:
-
-                    high_temp_td = tds[-5]
-                    low_temp_td = tds[-2]
-                    weather_type_day_td = tds[-7]
-                    weather_type_night_td = tds[-4]
-                    wind_td_day = tds[-6]
-                    wind_td_day_night = tds[-3]
+                this_city = list(tds[-8].stripped_strings)[0]
+
+                high_temp = list(tds[-5].stripped_strings)[0]
+                low_temp = list(tds[-2].stripped_strings)[0]
+                weather_typ_day = list(tds[-7].stripped_strings)[0]
+                weather_type_night = list(tds[-4].stripped_strings)[0]
+
+                wind_td_day = list(tds[-6].stripped_strings)
+                wind_td_day_night = list(tds[-3].stripped_strings)
+                wind_day = wind_td_day[0] + wind_td_day[1]
+                wind_night = wind_td_day_night[0] + wind_td_day_night[1]
+            except IndexError:
+                continue
+
+            # 如果没有白天的数据就使用夜间的
+            temp = f"{low_temp}——{high_temp}摄氏度" if high_temp != "-" else f"{low_temp}摄氏度"
+            weather_typ = weather_typ_day if weather_typ_day != "-" else weather_type_night
+            wind = f"{wind_day}" if wind_day != "--" else f"{wind_night}"
+            # 同名城市以先出现的为准（与逐行查找的结果一致）
+            index.setdefault(this_city, (this_city, temp, weather_typ, wind))
+    return index
+
+
+def fetch_region_index(url):
+    resp = http_client.get(url)
+    text = resp.content.decode("utf-8")
+    index = parse_region_page(text)
+    if not index:
+        # 页面标签不完整时lxml可能解析不到表格，退回容错性更好的html5lib
+        index = parse_region_page(text, 'html5lib')
+    return index
+
+
+def build_city_index():
+    # 并发抓取所有地区页面，合并为 {城市: 天气} 索引
+    # 返回 (索引, 是否完整)，单个地区页面失败时只缺少该地区的城市
+    def fetch(url):
+        try:
+            return fetch_region_index(url)
+        except Exception as e:
+            print(f"地区页面获取失败 {url}: {e}")
+            return None
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(REGION_URLS)) as executor:
+        region_indexes = list(executor.map(fetch, REGION_URLS))
+    city_index = {}
+    for region_index in region_indexes:  # 按地区顺序合并，保持原来的查找优先级
+        for city, weather in (region_index or {}).items():
+            city_index.setdefault(city, weather)
+    complete = all(region_indexes)  # 失败或解析为空的页面都算不完整
+    return city_index, complete
+
+
+def get_city_index():
+    # 只缓存完整的索引：部分页面失败或页面改版解析为空时，下次运行重新抓取
+    global _city_index
+    if _city_index is None:
+        city_index = market_cache.get("weather_cn", "city_index", ttl=CITY_INDEX_TTL)
+        if city_index is None:
+            city_index, complete = build_city_index()
+            if complete:
+                market_cache.put("weather_cn", "city_index", city_index)
+            else:
+                print("⚠️ 城市索引不完整，本次不写入缓存")
+        if not city_index:
+            return city_index  # 空索引不在进程内保留，下次查询重试
+        _city_index = city_index
+    return _city_index
 
-                    high_temp = list(high_temp_td.stripped_strings)[0]
-                    low_temp = list(low_temp_td.stripped_strings)[0]
-                    weather_typ_day = list(weather_type_day_td.stripped_strings)[0]
-                    weather_type_night = list(weather_type_night_td.stripped_strings)[0]
 
-                    wind_day = list(wind_td_day.stripped_strings)[0] + list(wind_td_day.stripped_strings)[1]
-                    wind_night = list(wind_td_day_night.stripped_strings)[0] + list(wind_td_day_night.stripped_strings)[1]
-
-                    # 如果没有白天的数据就使用夜间的
-                    temp = f"{low_temp}——{high_temp}摄氏度" if high_temp != "-" else f"{low_temp}摄氏度"
-                    weather_typ = weather_typ_day if weather_typ_day != "-" else weather_type_night
-                    wind = f"{wind_day}" if wind_day != "--" else f"{wind_night}"
-                    return this_city, temp, weather_typ, wind
+def get_weather(my_city):
+    # 查询N个城市只需抓取一次所有地区页面
+    return get_city_index().get(my_city)
 
 
 def get_access_token():
-    # 获取access token的url
-    url = 'https://api.weixin.qq.com/cgi-bin/token?grant_type=client_credential&appid={}&secret={}' \
-        .format(appID.strip(), appSecret.strip())
-    response = requests.get(url).json()
-    print(response)
-    access_token = response.get('access_token')
-    return access_token
+    # 获取access token（本地缓存有效期内的token，避免每次运行都请求）
+    return wechat_client.get_token_manager(appID, appSecret).get_token()
 
 
 def get_daily_love():
     # 每日一句情话
     url = "https://api.lovelive.tools/api/SweetNothings/Serialization/Json"
-    r = requests.get(url)
+    r = http_client.get(url)
     all_dict = json.loads(r.text)
     sentence = all_dict['returnObj'][0]
     daily_love = sentence
@@ -113,8 +170,10 @@ def send_weather(access_token, weather):
             }
         }
     }
-    url = 'https://api.weixin.qq.com/cgi-bin/message/template/send?access_token={}'.format(access_token)
-    print(requests.post(url, json.dumps(body)).text)
+    # token过期时会自动刷新后重试一次
+    result = wechat_client.get_token_manager(appID, appSecret).post(
+        "/cgi-bin/message/template/send", json.dumps(body).encode('utf-8'), access_token=access_token)
+    print(result)
 
 
 
@@ -0,0 +1,240 @@
+# 微信公众号接口客户端 - access token本地缓存（文件锁保护并发运行），提前刷新，失效时自动重试
+import concurrent.futures
+import json
+import os
+import threading
+import time
+
+import http_client
+import replay
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+API_BASE = "https://api.weixin.qq.com"
+TOKEN_CACHE_PATH = replay.state_path(os.environ.get(
+    "WECHAT_TOKEN_CACHE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "wechat_token.json")))
+# token有效期7200秒，剩余不足该秒数时提前刷新
+TOKEN_REFRESH_MARGIN = int(os.environ.get("WECHAT_TOKEN_REFRESH_MARGIN", "300"))
+
+# token无效或过期的错误码：40001 凭证无效，40014 不合法的token，42001 token超时
+TOKEN_ERRCODES = {40001, 40014, 42001}
+
+# 群发模板消息的速率与并发（微信接口有QPS上限）
+SEND_QPS = float(os.environ.get("WECHAT_SEND_QPS", "20"))
+SEND_WORKERS = int(os.environ.get("WECHAT_SEND_WORKERS", "8"))
+SEND_MAX_ROUNDS = int(os.environ.get("WECHAT_SEND_MAX_ROUNDS", "3"))
+
+# 重试也不会成功的错误码：40003 OpenID无效，40037 模板ID无效，43004 未关注，47003 模板参数错误
+PERMANENT_ERRCODES = {40003, 40037, 43004, 47003}
+
+TOKEN_ERROR_HINTS = {
+    40013: "AppID无效，请检查APP_ID",
+    40125: "AppSecret无效，请检查APP_SECRET",
+    40164: "调用接口的IP不在白名单中",
+    45009: "接口调用超过每日限额",
+}
+
+
+class _FileLock:
+    """跨进程文件锁（不支持fcntl的平台上退化为进程内锁）"""
+
+    _thread_lock = threading.Lock()
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        self._thread_lock.acquire()
+        if fcntl is not None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._file = open(self.path, "a")
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+        self._thread_lock.release()
+
+
+class TokenManager:
+    """管理单个公众号的access token，缓存文件按AppID保存token和过期时间"""
+
+    def __init__(self, app_id, app_secret, path=TOKEN_CACHE_PATH):
+        self.app_id = app_id.strip()
+        self.app_secret = app_secret.strip()
+        self.path = path
+        self._lock = _FileLock(path + ".lock")
+        self._entry = None  # 进程内缓存，避免每次调用都读文件
+
+    def _read_cache(self):
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_cache(self, cache):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(cache, f)
+        os.chmod(tmp_path, 0o600)
+        os.replace(tmp_path, self.path)
+
+    def _fetch(self):
+        url = f"{API_BASE}/cgi-bin/token"
+        params = {"grant_type": "client_credential", "appid": self.app_id, "secret": self.app_secret}
+        print(f"🔑 正在获取access token...")
+        response = http_client.get(url, params=params)
+        response.raise_for_status()
+        data = response.json()
+        if 'access_token' not in data:
+            print(f"❌ Access token获取失败: {data}")
+            errcode = data.get('errcode')
+            if errcode in TOKEN_ERROR_HINTS:
+                print(f"💡 解决建议: {TOKEN_ERROR_HINTS[errcode]}")
+            return None
+        print(f"✅ Access token获取成功")
+        return data['access_token'], time.time() + int(data.get('expires_in', 7200))
+
+    def get_token(self, force_refresh=False):
+        """返回有效的access token，缓存的token即将过期或force_refresh时重新获取"""
+        entry = self._entry
+        if not force_refresh and entry and entry["expires_at"] - time.time() > TOKEN_REFRESH_MARGIN:
+            return entry["access_token"]
+
+        with self._lock:
+            cache = self._read_cache()
+            entry = cache.get(self.app_id)
+            if not force_refresh and entry and entry["expires_at"] - time.time() > TOKEN_REFRESH_MARGIN:
+                print(f"💾 使用缓存的access token（剩余{int(entry['expires_at'] - time.time())}秒）")
+                self._entry = entry
+                return entry["access_token"]
+
+            fetched = self._fetch()
+            if fetched is None:
+                return None
+            access_token, expires_at = fetched
+            cache[self.app_id] = self._entry = {"access_token": access_token, "expires_at": expires_at}
+            try:
+                self._write_cache(cache)
+            except OSError as e:
+                print(f"⚠️ 保存access token缓存失败: {e}")
+            return access_token
+
+    def invalidate(self, access_token):
+        """标记token失效（仅当缓存中仍是该token时删除，避免覆盖其他进程刚刷新的token）"""
+        with self._lock:
+            if self._entry and self._entry["access_token"] == access_token:
+                self._entry = None
+            cache = self._read_cache()
+            entry = cache.get(self.app_id)
+            if entry and entry["access_token"] == access_token:
+                del cache[self.app_id]
+                self._write_cache(cache)
+
+    def post(self, path, payload, access_token=None, headers=None):
+        """POST到微信接口并返回响应JSON；token失效时刷新并重试一次
+
+        payload 为已序列化的请求体（bytes），避免重试时重复序列化。
+        """
+        access_token = access_token or self.get_token()
+        if not access_token:
+            raise RuntimeError("无法获取access token")
+        headers = headers or {'Content-Type': 'application/json; charset=utf-8'}
+
+        for attempt in range(2):
+            response = http_client.post(f"{API_BASE}{path}", params={"access_token": access_token},
+                                        data=payload, headers=headers)
+            response.raise_for_status()
+            result = response.json()
+            if result.get('errcode') not in TOKEN_ERRCODES or attempt == 1:
+                return result
+            print(f"🔄 access token已失效(errcode={result.get('errcode')})，刷新后重试")
+            # 其他线程/进程可能已经刷新过，invalidate后优先取缓存中的新token
+            self.invalidate(access_token)
+            access_token = self.get_token()
+            if not access_token:
+                return result
+        return result
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_token_manager(app_id, app_secret):
+    with _managers_lock:
+        key = app_id.strip()
+        if key not in _managers:
+            _managers[key] = TokenManager(app_id, app_secret)
+        return _managers[key]
+
+
+def build_template_payloads(recipient_groups, data, url="https://weixin.qq.com"):
+    """为每个接收者生成模板消息请求体
+
+    recipient_groups 为 {template_id: [openid, ...]}。共享的data只序列化一次，
+    每个请求体只拼接各自的touser/template_id部分。返回 {(template_id, openid): bytes}。
+    """
+    data_json = json.dumps(data, ensure_ascii=False).encode('utf-8')
+    url_json = json.dumps(url)
+    payloads = {}
+    for template_id, openids in recipient_groups.items():
+        template_json = json.dumps(template_id.strip())
+        for openid in openids:
+            head = f'{{"touser":{json.dumps(openid.strip())},"template_id":{template_json},"url":{url_json},"data":'
+            payloads[(template_id, openid)] = head.encode('utf-8') + data_json + b'}'
+    return payloads
+
+
+def send_template_fanout(manager, recipient_groups, data, url="https://weixin.qq.com",
+                         qps=SEND_QPS, max_workers=SEND_WORKERS, max_rounds=SEND_MAX_ROUNDS):
+    """按限速并发向多个接收者发送同一份模板消息数据
+
+    每轮只重发上一轮失败且可重试的接收者，最多max_rounds轮。
+    返回 {(template_id, openid): {"ok", "errcode", "errmsg", "attempts"}}。
+    """
+    payloads = build_template_payloads(recipient_groups, data, url)
+    results = {key: {"ok": False, "errcode": None, "errmsg": "未发送", "attempts": 0} for key in payloads}
+    if not payloads:
+        return results
+
+    limiter = http_client.RateLimiter(qps)
+
+    def send_one(key):
+        limiter.acquire()
+        try:
+            result = manager.post("/cgi-bin/message/template/send", payloads[key])
+            return result.get('errcode'), result.get('errmsg')
+        except Exception as e:
+            return None, str(e)
+
+    pending = list(payloads)
+    for round_index in range(max_rounds):
+        if not pending:
+            break
+        if round_index:
+            print(f"🔁 第{round_index + 1}轮重试{len(pending)}个失败的接收者")
+            time.sleep(min(2 ** round_index, 10))
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            outcomes = dict(zip(pending, executor.map(send_one, pending)))
+
+        pending = []
+        for key, (errcode, errmsg) in outcomes.items():
+            result = results[key]
+            result.update(ok=errcode == 0, errcode=errcode, errmsg=errmsg, attempts=result["attempts"] + 1)
+            if errcode != 0 and errcode not in PERMANENT_ERRCODES:
+                pending.append(key)
+
+    succeeded = sum(1 for r in results.values() if r["ok"])
+    print(f"📨 群发完成: 成功{succeeded}/{len(results)}")
+    return results